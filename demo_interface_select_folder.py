@@ -1,15 +1,119 @@
+import collections
+import itertools
 import json
+import queue
+import threading
 from tkinter import *
 import customtkinter
 from tkinter import filedialog
 from PIL import Image, ImageTk
-from face_qa.face_qa import FaceQA
+from face_qa.annotation import AnnotationSink
+from face_qa.cache import config_fingerprint
+from face_qa.config import ConfigError, load_config, resolve_config_path
+from face_qa.engine import FaceQAEngine
+from face_qa.metrics import MEASUREMENT_KEYS, evaluate, measurement_config
+import cv2
 import os
 import re
 
 customtkinter.set_appearance_mode("System")
 customtkinter.set_default_color_theme("dark-blue")
 
+VERSION = 2
+# Images scored ahead of navigation on each side of the current one
+PREFETCH = 3
+# Scored images (thumbnails and measurements) kept in memory
+CACHE_SIZE = 32
+# Slider changes are applied once the slider is still for this many milliseconds
+DEBOUNCE_MS = 250
+# Milliseconds between two checks of the background results
+POLL_MS = 30
+THUMBNAIL_SIZE = (300, 300)
+ANNOTATION_SIZE = (150, 150)
+
+
+class ThumbnailSink(AnnotationSink):
+    '''
+    Keep the annotated images as small PIL images, ready to be shown
+    '''
+    def write(self, request_id, name, image):
+        if image.ndim == 2:
+            thumbnail = Image.fromarray(image)
+        else:
+            thumbnail = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        return thumbnail.resize(ANNOTATION_SIZE, Image.Resampling.LANCZOS)
+
+
+class Scored():
+    '''
+    One image prepared by the BackgroundScorer: its thumbnail, measurements and annotation thumbnails
+    '''
+    def __init__(self, thumbnail, metrics, annotations):
+        self.thumbnail = thumbnail
+        self.metrics = metrics
+        self.annotations = annotations
+
+
+class BackgroundScorer():
+    '''
+    Scores images on its own thread, the most urgent first, so the Tk thread never waits for a check.
+    Finished images are put on results as (key, Scored), or (key, exception) when they fail.
+    '''
+    def __init__(self, version):
+        self.version = version
+        self.results = queue.Queue()
+        self._jobs = queue.PriorityQueue()
+        self._order = itertools.count()
+        # Best priority of each queued key, a key popped with another priority was already done or dropped
+        self._queued = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="face-qa-viewer", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, path, config, priority):
+        with self._lock:
+            if key in self._queued and self._queued[key] <= priority:
+                return
+            self._queued[key] = priority
+        self._jobs.put((priority, next(self._order), key, path, config))
+
+    def keep_only(self, keys):
+        '''
+        Drop the queued images that are not in keys (far from the current image)
+        '''
+        with self._lock:
+            self._queued = {key: priority for key, priority in self._queued.items() if key in keys}
+
+    def _run(self):
+        # The models are loaded on this thread, the window opens without waiting for them
+        engine = FaceQAEngine()
+        while True:
+            priority, _, key, path, config = self._jobs.get()
+            if key is None:
+                break
+            with self._lock:
+                if self._queued.get(key) != priority:
+                    continue
+                del self._queued[key]
+            try:
+                scored = self._score(engine, path, config)
+            except Exception as e:
+                scored = e
+            self.results.put((key, scored))
+        engine.close()
+
+    def _score(self, engine, path, config):
+        result = engine.check(path, self.version, config, annotate=ThumbnailSink())
+        image = Image.open(path)
+        # JPEGs are decoded directly at a reduced size
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        return Scored(image, result.metrics, result.annotations or {})
+
+    def close(self):
+        self._jobs.put((-1, -1, None, None, None))
+        self._thread.join(timeout=5)
+
 
 class FaceQAViewer(customtkinter.CTk):
 
@@ -27,8 +131,13 @@ class FaceQAViewer(customtkinter.CTk):
         self.current_index = 0
 
         self.thresholds = self.load_config()
-        self.face_qa = None
-        self.image = None
+        self.scorer = BackgroundScorer(VERSION)
+        # Scored images by (path, measurement settings), least recently shown first
+        self.scored = collections.OrderedDict()
+        self.current = None
+        self.annotation_labels = []
+        self._pending_sliders = None
+        self._measurement_changed = False
 
         # Frames
         self.frame_menu = customtkinter.CTkFrame(master=self, width=180, corner_radius=0)
@@ -47,6 +156,9 @@ class FaceQAViewer(customtkinter.CTk):
         self.label_1 = customtkinter.CTkLabel(master=self.frame_menu, text="FaceQA Viewer")
         self.label_1.pack()
 
+        self.image_label = Label(self.frame_initial)
+        self.image_label.pack()
+
         self.button_select_folder = customtkinter.CTkButton(
             master=self.frame_info,
             text="Select folder",
@@ -68,42 +180,57 @@ class FaceQAViewer(customtkinter.CTk):
         )
         self.button_previous.pack(pady=5)
 
+        self.button_save = customtkinter.CTkButton(
+            master=self.frame_info,
+            text="Save thresholds",
+            command=self.save_config
+        )
+        self.button_save.pack(pady=5)
+
         # Sliders
         self.add_slider("scale_factor_face_cascade", "Face scale factor", 1, 10, 0.1)
         self.add_slider("min_neighbors_face_cascade", "Min neighbors for face", 1, 50)
         self.add_slider("brightness_threshold", "Min brightness", 0, 255)
         self.add_slider("contrast_threshold", "Min contrast", 0, 100)
         self.add_slider("face_center_threshold", "Center deviation", 0, 1, 0.01)
-        self.add_slider("face_height_adcional", "Extra face height", 0, 1000, 1)
+        self.add_slider("eye_region_height", "Eye region height", 0.1, 1, 0.01)
         self.add_slider("eye_area_threshold", "Eye area", 0, 1, 0.01)
         self.add_slider("smile_ratio_threshold", "Smile area", 0, 100, 1)
 
+        self.after(POLL_MS, self.poll_results)
+
     def load_config(self):
         """Load configuration from JSON file"""
         try:
-            file_path = os.path.join(os.path.dirname(__file__), 'face_qa/config.json')
-            with open(file_path, 'r') as file:
-                config = json.load(file)
-            return config
+            return load_config()
         except Exception as e:
             print(f"Error loading config file: {e}")
             exit(1)
 
     def save_config(self):
-        """Save configuration to JSON file"""
+        """Save the slider values to the JSON file, keeping its profiles"""
         try:
-            file_path = os.path.join(os.path.dirname(__file__), 'face_qa/config.json')
+            file_path = resolve_config_path('/config.json')
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+            data.update(dict(self.thresholds))
             with open(file_path, 'w') as file:
-                json.dump(self.thresholds, file, indent=4)
+                json.dump(data, file, indent=4)
         except Exception as e:
             print(f"Error saving config file: {e}")
 
     def add_slider(self, key, label_text, min_val, max_val, step=1):
         def update_slider(value):
-            self.thresholds[key] = float(value) if isinstance(step, float) else int(value)
-            self.save_config()
-            if self.image_paths:
-                self.load_image(self.image_paths[self.current_index])
+            try:
+                self.thresholds = self.thresholds.replace(**{key: float(value) if isinstance(step, float) else int(value)})
+            except ConfigError as e:
+                print(e)
+                return
+            self._measurement_changed |= key in MEASUREMENT_KEYS
+            # Wait for the slider to stop before checking again
+            if self._pending_sliders is not None:
+                self.after_cancel(self._pending_sliders)
+            self._pending_sliders = self.after(DEBOUNCE_MS, self.apply_sliders)
 
         label = customtkinter.CTkLabel(master=self.frame_controls, text=label_text)
         label.pack()
@@ -111,9 +238,20 @@ class FaceQAViewer(customtkinter.CTk):
                                          from_=min_val, to=max_val,
                                          number_of_steps=int((max_val - min_val) / step),
                                          command=update_slider)
-        slider.set(self.thresholds[key])
+        slider.set(self.thresholds.get(key, min_val))
         slider.pack(pady=5)
 
+    def apply_sliders(self):
+        self._pending_sliders = None
+        if self._measurement_changed:
+            # The measurements depend on the changed setting, the images are scored again
+            self._measurement_changed = False
+            if self.image_paths:
+                self.load_image(self.image_paths[self.current_index])
+        elif self.current is not None:
+            # Only a threshold changed, evaluate the stored measurements again
+            self.show_result(evaluate(self.current.metrics, self.thresholds))
+
     def select_folder(self):
         folder_path = filedialog.askdirectory(title='Select image folder')
         print(f"Selected folder: {folder_path}")
@@ -145,38 +283,73 @@ class FaceQAViewer(customtkinter.CTk):
         else:
             print("Beginning of images.")
 
+    def image_key(self, file_path):
+        # Results only depend on the measurement settings, thresholds are applied when shown
+        return file_path, config_fingerprint(measurement_config(self.thresholds))
+
     def load_image(self, file_path):
         self.label_1.configure(text=os.path.basename(file_path))
 
+        key = self.image_key(file_path)
+        if key in self.scored:
+            self.scored.move_to_end(key)
+            self.display(self.scored[key])
+        else:
+            self.current = None
+            self.label_1.configure(text=f"{os.path.basename(file_path)} (scoring...)")
+            self.scorer.submit(key, file_path, self.thresholds, 0)
+
+        # Score the neighbours while the current image is looked at, the closest first
+        wanted = {key}
+        for distance in range(1, PREFETCH + 1):
+            for index in (self.current_index + distance, self.current_index - distance):
+                if 0 <= index < len(self.image_paths):
+                    neighbour = self.image_key(self.image_paths[index])
+                    wanted.add(neighbour)
+                    if neighbour not in self.scored:
+                        self.scorer.submit(neighbour, self.image_paths[index], self.thresholds, distance)
+        self.scorer.keep_only(wanted)
+
+    def poll_results(self):
         try:
-            image = Image.open(file_path)
-            self.image_check(file_path)
-
-            if self.image:
-                self.image_label.configure(image=None)
-                self.image_label.image = None
-
-            if image.width > 300 or image.height > 300:
-                ratio = min(300 / image.width, 300 / image.height)
-                image = image.resize((int(image.width * ratio), int(image.height * ratio)), Image.Resampling.LANCZOS)
-
-            if hasattr(self, "image_label"):
-                self.image_label.pack_forget()
-                self.image_label.destroy()
-
-            photo = ImageTk.PhotoImage(image)
-            self.image_label = Label(self.frame_initial, image=photo)
-            self.image_label.image = photo
-            self.image_label.pack()
-
-            self.image = image
-        except Exception as e:
-            print(f"Error loading image {file_path}: {e}")
-
-    def image_check(self, file_path):
-        validator = FaceQA(image_path=file_path, version=2)
-        result = validator.check_face()
-
+            while True:
+                key, scored = self.scorer.results.get_nowait()
+                current = self.image_paths and key == self.image_key(self.image_paths[self.current_index])
+                if isinstance(scored, Exception):
+                    print(f"Error loading image {key[0]}: {scored}")
+                    if current:
+                        self.label_1.configure(text=os.path.basename(key[0]))
+                    continue
+                self.scored[key] = scored
+                if len(self.scored) > CACHE_SIZE:
+                    self.scored.popitem(last=False)
+                if current:
+                    self.label_1.configure(text=os.path.basename(key[0]))
+                    self.display(scored)
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self.poll_results)
+
+    def display(self, scored):
+        self.current = scored
+
+        photo = ImageTk.PhotoImage(scored.thumbnail)
+        self.image_label.configure(image=photo)
+        self.image_label.image = photo
+
+        for label in self.annotation_labels:
+            label.destroy()
+        self.annotation_labels = []
+        for name, thumbnail in scored.annotations.items():
+            photo = ImageTk.PhotoImage(thumbnail)
+            label = Label(self.frame_initial, image=photo)
+            label.image = photo
+            label.pack(side=RIGHT, padx=5)
+            self.annotation_labels.append(label)
+
+        self.show_result(evaluate(scored.metrics, self.thresholds))
+
+    def show_result(self, result):
         for attr in ["label_face", "label_eyes", "is_smiling", "contrast_is_good",
                      "brightness_is_good", "face_is_centralized", "more_than_one_face"]:
             if hasattr(self, attr):
@@ -204,26 +377,8 @@ class FaceQAViewer(customtkinter.CTk):
             create_label("brightness_is_good", "Good brightness" if result["brightness_is_good"] else "Poor brightness", result["brightness_is_good"])
             create_label("face_is_centralized", "Face centered" if result["face_is_centralized"] else "Face not centered", result["face_is_centralized"])
 
-        for widget in self.frame_initial.winfo_children():
-            if isinstance(widget, Label) and widget != self.image_label:
-                widget.destroy()
-
-        output_dir = os.path.join("output")
-        if os.path.exists(output_dir):
-            for file in os.listdir(output_dir):
-                if file.endswith((".png", ".jpg")):
-                    try:
-                        img_path = os.path.join(output_dir, file)
-                        img = Image.open(img_path)
-                        img = img.resize((150, 150), Image.Resampling.LANCZOS)
-                        photo = ImageTk.PhotoImage(img)
-                        label = Label(self.frame_initial, image=photo)
-                        label.image = photo
-                        label.pack(side=RIGHT, padx=5)
-                    except Exception as e:
-                        print(f"Error displaying image {file}: {e}")
-
     def on_closing(self, event=0):
+        self.scorer.close()
         self.destroy()
 
 
@@ -0,0 +1,177 @@
+import argparse
+import json
+import logging
+import sys
+import cv2
+import numpy as np
+from face_qa.batch import check_many
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _check_command(args):
+    scored = []
+    for source, result in check_many(args.inputs, version=args.version, workers=args.workers,
+                                     mode=args.mode, ordered=args.ordered, prefetch=args.prefetch,
+                                     profile=args.profile):
+        if isinstance(result, Exception):
+            line = {"input": source, "error": str(result)}
+        else:
+            line = {"input": source, "result": result.to_dict()}
+            if args.records:
+                scored.append((source, result))
+        sys.stdout.write(json.dumps(line, default=_json_default) + "\n")
+        sys.stdout.flush()
+
+    if args.records:
+        from face_qa.result import to_records
+        np.save(args.records, to_records([result for _, result in scored], names=[source for source, _ in scored]))
+
+
+def _serve_command(args):
+    from face_qa.server import serve
+    logging.basicConfig(level=logging.INFO)
+    serve(host=args.host, port=args.port, workers=args.workers, max_queue=args.max_queue,
+          threads=args.threads, version=args.version, timeout=args.timeout,
+          max_batch_size=args.max_batch_size, max_download_bytes=args.max_download_bytes,
+          cache_size=args.cache_size, cache_ttl=args.cache_ttl, cache_path=args.cache_path, mode=args.mode,
+          shared_memory_slab=args.shared_memory_slab_mb << 20, profiling=args.profiling)
+
+
+def _bench_command(args):
+    from face_qa.benchmark import main as bench_main
+    bench_main(args)
+
+
+def _stream_command(args):
+    from face_qa.stream import StreamQA
+    source = int(args.source) if args.source.isdigit() else args.source
+    with StreamQA(source, version=args.version, window=args.window) as stream:
+        for update in stream.frames(args.max_frames):
+            line = {k: update[k] for k in ("index", "timestamp_ms", "dropped", "smoothed")}
+            sys.stdout.write(json.dumps(line, default=_json_default) + "\n")
+            sys.stdout.flush()
+        if args.best and stream.best is not None:
+            cv2.imwrite(args.best, stream.best["frame"])
+
+
+def _scan_command(args):
+    from face_qa.scan import DEFAULT_PATTERNS, scan_directory
+    scan_directory(args.root, args.output, version=args.version, output_format=args.format,
+                   include=args.include or DEFAULT_PATTERNS, exclude=args.exclude or (), workers=args.workers,
+                   profile=args.profile, checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every,
+                   progress=not args.quiet, restart=args.restart)
+
+
+def _dedupe_command(args):
+    from face_qa.dedupe import dedupe_report
+    from face_qa.scan import DEFAULT_PATTERNS
+    report = dedupe_report(args.root, max_distance=args.max_distance, method=args.method,
+                           include=args.include or DEFAULT_PATTERNS, exclude=args.exclude or ())
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m face_qa", description="Face image quality checks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check = subparsers.add_parser("check", help="Score images and print one JSON line per image")
+    check.add_argument("inputs", nargs="+", help="Image files or directories")
+    check.add_argument("--version", type=int, default=1, choices=[1, 2], help="1: haarcascade 2: mediapipe BlazeFace")
+    check.add_argument("--workers", type=int, default=None, help="Number of workers (default: number of CPUs)")
+    check.add_argument("--mode", default="process", choices=["process", "thread"])
+    check.add_argument("--ordered", action="store_true", help="Print results in input order")
+    check.add_argument("--prefetch", type=int, default=None, help="Maximum number of images in flight")
+    check.add_argument("--profile", default=None, help="Named profile of the configuration file, e.g. passport")
+    check.add_argument("--records", default=None, help="Also save the results as a numpy structured array (.npy)")
+    check.set_defaults(func=_check_command)
+
+    serve = subparsers.add_parser("serve", help="Run the HTTP service")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=5000)
+    serve.add_argument("--workers", type=int, default=None, help="Number of scoring processes (default: number of CPUs)")
+    serve.add_argument("--max-queue", type=int, default=64, help="Images queued or running before answering 429")
+    serve.add_argument("--threads", type=int, default=16, help="HTTP handler threads")
+    serve.add_argument("--mode", default="process", choices=["process", "thread"],
+                       help="Score in worker processes or in threads of the service (profiled by /profile)")
+    serve.add_argument("--version", type=int, default=1, choices=[1, 2], help="Default face classificator")
+    serve.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a result before answering 504")
+    serve.add_argument("--max-batch-size", type=int, default=32, help="Maximum number of images per /batch request")
+    serve.add_argument("--max-download-bytes", type=int, default=10 * 1024 * 1024, help="Maximum size of an image downloaded by /url")
+    serve.add_argument("--cache-size", type=int, default=1024, help="Results kept in memory, 0 disables the cache")
+    serve.add_argument("--cache-ttl", type=float, default=None, help="Seconds a cached result stays valid")
+    serve.add_argument("--cache-path", default=None, help="sqlite file keeping cached results across restarts")
+    serve.add_argument("--shared-memory-slab-mb", type=int, default=0,
+                       help="Hand images to the workers through shared memory slabs of this size, 0 pickles them")
+    serve.add_argument("--profiling", action="store_true",
+                       help="Serve /profile, a sampling profiler anyone reaching the service can switch on")
+    serve.set_defaults(func=_serve_command)
+
+    bench = subparsers.add_parser("bench", help="Benchmark the pipeline and print a JSON report")
+    bench.add_argument("--versions", type=int, nargs="+", default=[1, 2], choices=[1, 2])
+    bench.add_argument("--resolutions", default="vga,hd,fhd,4k,12mp", help="Synthetic image sizes: vga,hd,fhd,4k,12mp")
+    bench.add_argument("--repeat", type=int, default=5, help="Warm runs per image")
+    bench.add_argument("--workers", default=None, help="Worker counts for the throughput test, e.g. 1,2,4")
+    bench.add_argument("--throughput-count", type=int, default=64, help="Images scored per throughput run")
+    bench.add_argument("--allocations", action="store_true", help="Record per-stage peak allocations with tracemalloc")
+    bench.add_argument("--annotate", action="store_true", help="Include PNG annotation encoding")
+    bench.add_argument("--analysis-edges", default=None,
+                       help="Analysis resolutions (long edge) compared with full resolution, e.g. 640,960,1280")
+    bench.add_argument("--detectors", default=None,
+                       help="Detector backends compared with the first one, e.g. haar,blazeface,yunet")
+    bench.add_argument("--detector-model", default=None, help="ONNX file of the yunet detector")
+    bench.add_argument("--corpus", default=None, help="Folder of images used instead of the bundled examples")
+    bench.add_argument("--output", default=None, help="Write the report to this file instead of stdout")
+    bench.set_defaults(func=_bench_command)
+
+    scan = subparsers.add_parser("scan", help="Score a directory tree into a JSONL/CSV file, resumable")
+    scan.add_argument("root", help="Directory scanned recursively")
+    scan.add_argument("--output", required=True, help="Results file (.jsonl or .csv)")
+    scan.add_argument("--format", default=None, choices=["jsonl", "csv"], help="Default: from the output extension")
+    scan.add_argument("--include", action="append", help="Glob of file names to score (repeatable, default: images)")
+    scan.add_argument("--exclude", action="append", help="Glob of names or relative paths to skip (repeatable)")
+    scan.add_argument("--version", type=int, default=1, choices=[1, 2], help="1: haarcascade 2: mediapipe BlazeFace")
+    scan.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    scan.add_argument("--profile", default=None, help="Named profile of the configuration file")
+    scan.add_argument("--checkpoint", default=None, help="Progress file (default: <output>.checkpoint)")
+    scan.add_argument("--checkpoint-every", type=int, default=1000, help="Results written between checkpoints")
+    scan.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first image")
+    scan.add_argument("--quiet", action="store_true", help="No progress display")
+    scan.set_defaults(func=_scan_command)
+
+    dedupe = subparsers.add_parser("dedupe", help="Report the groups of near-duplicate images of a directory tree")
+    dedupe.add_argument("root", help="Directory scanned recursively")
+    dedupe.add_argument("--max-distance", type=int, default=4, help="Maximum Hamming distance of two near-duplicate hashes (of 64 bits)")
+    dedupe.add_argument("--method", default="dhash", choices=["dhash", "phash"], help="Perceptual hash")
+    dedupe.add_argument("--include", action="append", help="Glob of file names to compare (repeatable, default: images)")
+    dedupe.add_argument("--exclude", action="append", help="Glob of names or relative paths to skip (repeatable)")
+    dedupe.add_argument("--output", default=None, help="Write the report to this file instead of stdout")
+    dedupe.set_defaults(func=_dedupe_command)
+
+    stream = subparsers.add_parser("stream", help="Score a camera or video file and print one JSON line per frame")
+    stream.add_argument("source", help="Camera index (e.g. 0) or video file")
+    stream.add_argument("--version", type=int, default=2, choices=[1, 2], help="1: haarcascade 2: mediapipe BlazeFace")
+    stream.add_argument("--window", type=int, default=15, help="Frames the verdicts are smoothed over")
+    stream.add_argument("--max-frames", type=int, default=None, help="Stop after this number of scored frames")
+    stream.add_argument("--best", default=None, help="Save the best frame to this image file")
+    stream.set_defaults(func=_stream_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
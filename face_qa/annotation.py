@@ -0,0 +1,80 @@
+from typing import Any, Dict
+import uuid
+import cv2
+import numpy as np
+import os
+
+class AnnotationSink():
+    '''
+    Destination of the annotated images drawn by the checks.
+    Annotation is off unless a sink is given to FaceQA or FaceQAEngine.check().
+    '''
+    def begin(self) -> 'Annotations':
+        '''
+        Start collecting the annotations of one check() call
+        '''
+        return Annotations(self, uuid.uuid4().hex)
+
+    def write(self, request_id: str, name: str, image: np.ndarray) -> Any:
+        '''
+        Store one annotated image, the returned value goes to result["annotations"][name]
+        '''
+        raise NotImplementedError
+
+
+class DirectorySink(AnnotationSink):
+    '''
+    Write each annotated image to folder_path as <request id>_<name><extension>.
+    The request id is unique so concurrent checks never overwrite each other.
+    '''
+    def __init__(self, folder_path: str = 'output', extension: str = '.png'):
+        self.folder_path = folder_path
+        self.extension = extension
+        os.makedirs(folder_path, exist_ok=True)
+
+    def write(self, request_id: str, name: str, image: np.ndarray) -> str:
+        output_path = os.path.join(self.folder_path, f"{request_id}_{name}{self.extension}")
+        cv2.imwrite(output_path, image)
+        return output_path
+
+
+class MemorySink(AnnotationSink):
+    '''
+    Keep the annotated images as np.ndarray in the result
+    '''
+    def write(self, request_id: str, name: str, image: np.ndarray) -> np.ndarray:
+        return image
+
+
+class BytesSink(AnnotationSink):
+    '''
+    Return the annotated images encoded (PNG by default) in the result
+    '''
+    def __init__(self, extension: str = '.png'):
+        self.extension = extension
+
+    def write(self, request_id: str, name: str, image: np.ndarray) -> bytes:
+        ok, buffer = cv2.imencode(self.extension, image)
+        if not ok:
+            raise ValueError(f"Could not encode annotation {name} as {self.extension}")
+        return buffer.tobytes()
+
+
+class Annotations():
+    '''
+    Annotated images of a single check() call.
+    The images are only handed to the sink by collect(), so the encoding and
+    disk writes can happen after the models are released.
+    '''
+    def __init__(self, sink: AnnotationSink, request_id: str):
+        self.sink = sink
+        self.request_id = request_id
+        self._pending = []
+
+    def add(self, name: str, image: np.ndarray):
+        self._pending.append((name, image))
+
+    def collect(self) -> Dict[str, Any]:
+        items = {name: self.sink.write(self.request_id, name, image) for name, image in self._pending}
+        self._pending = []
+        return items
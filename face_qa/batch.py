@@ -0,0 +1,151 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, Tuple, Union
+import collections
+import multiprocessing
+import threading
+import os
+from face_qa.engine import FaceQAEngine
+from face_qa.shm import SharedRef, SlabPool, attach
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Engine of the current worker (process or thread), created by the pool initializer
+_worker_state = threading.local()
+
+
+def iter_inputs(inputs: Union[str, os.PathLike, Iterable[Any]]) -> Iterator[Any]:
+    '''
+    inputs: A directory, a single image path or any iterable of image sources
+    Directories are walked recursively and only image files are yielded.
+    '''
+    if isinstance(inputs, (str, os.PathLike)):
+        inputs = [inputs]
+
+    for item in inputs:
+        if isinstance(item, (str, os.PathLike)) and os.path.isdir(item):
+            yield from _walk_images(os.fspath(item))
+        else:
+            yield item
+
+
+def _walk_images(folder_path: str) -> Iterator[str]:
+    with os.scandir(folder_path) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_images(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+
+def _init_worker(config_path: str):
+    # Every worker loads its own models once
+    _worker_state.engine = FaceQAEngine(config_path)
+
+
+def _preload_worker() -> int:
+    # The initializer loaded the cascades, the MediaPipe models are loaded here instead of on the first image
+    _worker_state.engine.preload()
+    return os.getpid()
+
+
+def _check_worker(image, version: int, profile: str = None):
+    try:
+        return _worker_state.engine.check(image, version, profile=profile)
+    except Exception as e:
+        return e
+
+
+def _check_shared_worker(ref: SharedRef, version: int, profile: str = None):
+    # The image is read in place from the parent's shared memory slab
+    return _check_worker(attach(ref), version, profile)
+
+
+def submit_check(executor: Executor, image, version: int, profile: str = None, slabs: SlabPool = None) -> Future:
+    '''
+    Queue one image on executor, through a shared memory slab when slabs is given and the image fits one
+    '''
+    ref = slabs.put(image) if slabs is not None else None
+    if ref is None:
+        return executor.submit(_check_worker, image, version, profile)
+    future = executor.submit(_check_shared_worker, ref, version, profile)
+    future.add_done_callback(lambda _: slabs.release(ref))
+    return future
+
+
+def _create_executor(workers: int, mode: str, config_path: str) -> Executor:
+    if mode == "process":
+        # spawn avoids forking a parent that already holds MediaPipe graphs
+        return ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker,
+                                   initargs=(config_path,))
+    elif mode == "thread":
+        return ThreadPoolExecutor(max_workers=workers,
+                                  initializer=_init_worker,
+                                  initargs=(config_path,))
+    raise ValueError(f"Unknown mode: {mode}")
+
+
+def check_many(inputs, version: int = 1, workers: int = None, mode: str = "process",
+               ordered: bool = False, prefetch: int = None,
+               config_path: str = '/config.json', profile: str = None,
+               shared_memory_slab: int = 0) -> Iterator[Tuple[Any, Any]]:
+    '''
+    Score many images on a pool of workers, each one with its own preloaded models.
+
+    inputs: A directory, an image path or any iterable of image sources (see iter_inputs)
+    version: Face Classificator 1: haarcascade 2: mediapipe BlazeFace
+    workers: Number of workers (os.cpu_count() if None)
+    mode: "process" or "thread"
+    ordered: Yield in input order instead of completion order
+    prefetch: Maximum number of images in flight (2 * workers if None), keeps memory flat
+    profile: Named profile of the configuration file
+    shared_memory_slab: In process mode, bytes and arrays up to this size reach the workers
+    through reused shared memory slabs instead of being pickled (see face_qa.shm), off if 0
+
+    Yields (input, result) pairs. When an image fails the result is the exception raised.
+    '''
+    workers = workers or os.cpu_count() or 1
+    prefetch = max(prefetch or 2 * workers, 1)
+    sources = iter_inputs(inputs)
+
+    executor = _create_executor(workers, mode, config_path)
+    # One slab per image in flight, so a slab is always free
+    slabs = SlabPool(shared_memory_slab, prefetch) if shared_memory_slab and mode == "process" else None
+    try:
+        if ordered:
+            yield from _run_ordered(executor, sources, version, prefetch, profile, slabs)
+        else:
+            yield from _run_unordered(executor, sources, version, prefetch, profile, slabs)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if slabs is not None:
+            slabs.close()
+
+
+def _run_ordered(executor: Executor, sources: Iterator[Any], version: int, prefetch: int, profile: str = None,
+                 slabs: SlabPool = None):
+    pending = collections.deque()
+    for source in sources:
+        pending.append((source, submit_check(executor, source, version, profile, slabs)))
+        if len(pending) >= prefetch:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def _run_unordered(executor: Executor, sources: Iterator[Any], version: int, prefetch: int, profile: str = None,
+                   slabs: SlabPool = None):
+    pending = {}
+    for source in sources:
+        pending[submit_check(executor, source, version, profile, slabs)] = source
+        if len(pending) >= prefetch:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
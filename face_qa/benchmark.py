@@ -0,0 +1,437 @@
+'''
+Benchmark of the FaceQA pipeline.
+
+Runs check() for each detector version over the bundled example images and
+synthetic images at several resolutions, and reports as JSON:
+- per-stage wall time (decode, detection, eyes, smile, contrast, brightness, centering, annotation)
+- per-stage peak Python/NumPy allocations (tracemalloc, optional)
+- cold start (engine construction and first check) vs warm latency
+- import time and resident memory of a fresh process, lazily and with preload()
+- throughput of check_many with 1..N worker processes
+- accuracy vs speed of each analysis resolution (analysis_long_edge) against full resolution
+- latency and agreement of the face detector backends (face_qa.detectors)
+
+python -m face_qa bench --output bench.json
+'''
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import os
+from face_qa.annotation import BytesSink
+from face_qa.batch import IMAGE_EXTENSIONS, check_many
+from face_qa.engine import FaceQAEngine
+from face_qa.image_loader import load_image
+from face_qa.stages import StageTimer
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'images')
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+    "12mp": (4000, 3000),
+}
+
+
+class AllocationTimer(StageTimer):
+    '''
+    StageTimer that also records the peak traced allocation of each stage (tracemalloc must be running)
+    '''
+    def __init__(self, hooks: Sequence = ()):
+        super().__init__(hooks)
+        self.allocations: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        with super().stage(name):
+            yield
+        _, peak = tracemalloc.get_traced_memory()
+        self.allocations[name] = max(self.allocations.get(name, 0), peak - start)
+
+
+def bundled_images(folder_path: str = EXAMPLES_DIR) -> List[Tuple[str, bytes]]:
+    if not os.path.isdir(folder_path):
+        return []
+    images = []
+    for name in sorted(os.listdir(folder_path)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(folder_path, name), 'rb') as image_file:
+                images.append((name, image_file.read()))
+    return images
+
+
+def synthetic_images(resolutions: List[str], base: bytes = None) -> List[Tuple[str, bytes]]:
+    '''
+    JPEG images of each resolution, made by scaling a face image (or a gradient when there is none)
+    to the target height and padding it to the target width
+    '''
+    if base is not None:
+        face = cv2.imdecode(np.frombuffer(base, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        face = np.tile(np.linspace(0, 255, 512, dtype=np.uint8), (512, 1))
+        face = cv2.cvtColor(face, cv2.COLOR_GRAY2BGR)
+
+    images = []
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        scaled_width = min(width, int(face.shape[1] * height / face.shape[0]))
+        scaled = cv2.resize(face, (scaled_width, height), interpolation=cv2.INTER_LINEAR)
+        pad = width - scaled_width
+        image = cv2.copyMakeBorder(scaled, 0, 0, pad // 2, pad - pad // 2, cv2.BORDER_REFLECT)
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append((f"synthetic_{name}_{width}x{height}.jpg", buffer.tobytes()))
+    return images
+
+
+def _stats(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        "mean": statistics.fmean(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+        "min": values[0],
+        "max": values[-1],
+    }
+
+
+def bench_version(version: int, images: List[Tuple[str, bytes]], repeat: int = 5,
+                  allocations: bool = False, annotate: bool = False) -> dict:
+    '''
+    Cold start and warm per-stage latency of one detector version
+    '''
+    start = time.perf_counter()
+    engine = FaceQAEngine()
+    engine_init = time.perf_counter() - start
+
+    # PNG encoding of the annotations is what the annotation stage costs in production
+    sink = BytesSink() if annotate else None
+    report = {"cold_start": {}, "images": {}}
+    try:
+        start = time.perf_counter()
+        engine.check(images[0][1], version, annotate=sink)
+        report["cold_start"] = {"engine_init_s": engine_init, "first_check_s": time.perf_counter() - start}
+
+        for name, data in images:
+            height, width = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape[:2]
+            totals, stages = [], {}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = engine.check(data, version, annotate=sink)
+                totals.append(time.perf_counter() - start)
+                for stage, seconds in result["timings"].items():
+                    stages.setdefault(stage, []).append(seconds)
+
+            entry = {
+                "size": [width, height],
+                "bytes": len(data),
+                "face_detected": result["face_detected"],
+                "total_s": _stats(totals),
+                "stages_s": {stage: _stats(values) for stage, values in stages.items()},
+            }
+            if allocations:
+                entry["allocations_bytes"] = _allocations(engine, data, version, sink)
+            report["images"][name] = entry
+    finally:
+        engine.close()
+    return report
+
+
+def _allocations(engine: FaceQAEngine, data: bytes, version: int, sink) -> Dict[str, int]:
+    started = tracemalloc.is_tracing()
+    if not started:
+        tracemalloc.start()
+    timer_factory = engine.timer_factory
+    timers = []
+
+    def factory():
+        timers.append(AllocationTimer())
+        return timers[-1]
+
+    engine.timer_factory = factory
+    try:
+        engine.check(data, version, annotate=sink)
+    finally:
+        engine.timer_factory = timer_factory
+        if not started:
+            tracemalloc.stop()
+    return timers[-1].allocations
+
+
+def bench_throughput(version: int, images: List[Tuple[str, bytes]], workers: List[int], count: int = 64) -> Dict[str, float]:
+    '''
+    Images per second of check_many with each number of worker processes.
+    Timed from the first result, so process start and model loading are excluded.
+    '''
+    sources = [images[i % len(images)][1] for i in range(count)]
+    report = {}
+    for worker_count in workers:
+        first = None
+        done = 0
+        for _ in check_many(sources, version=version, workers=worker_count, mode="process"):
+            done += 1
+            if first is None:
+                first = time.perf_counter()
+        elapsed = time.perf_counter() - first
+        report[str(worker_count)] = (done - 1) / elapsed if elapsed > 0 else None
+    return report
+
+
+def _iou(a, b) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    union = aw * ah + bw * bh - w * h
+    return w * h / union if union else 0.0
+
+
+def _timed_check(engine: FaceQAEngine, data: bytes, version: int, config: dict, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = engine.check(data, version, config)
+        times.append(time.perf_counter() - start)
+    faces = engine.detect_faces(load_image(data), version, config)
+    return result, faces, statistics.fmean(times)
+
+
+def bench_analysis(version: int, images: List[Tuple[str, bytes]], long_edges: List[int], repeat: int = 3) -> dict:
+    '''
+    Accuracy vs speed of each analysis resolution against the full resolution results:
+    agreement of every boolean check, IoU of the main face box, relative error of each
+    metric and mean check() latency
+    '''
+    report = {}
+    with FaceQAEngine() as engine:
+        full_config = {**engine.config, "analysis_long_edge": None}
+        reference = {name: _timed_check(engine, data, version, full_config, repeat) for name, data in images}
+        full_time = statistics.fmean(seconds for _, _, seconds in reference.values())
+        report["full"] = {"mean_s": full_time}
+
+        for long_edge in long_edges:
+            config = {**engine.config, "analysis_long_edge": long_edge}
+            checks, agree, ious, errors, times, disagreements = 0, 0, [], {}, [], []
+            for name, data in images:
+                result, faces, seconds = _timed_check(engine, data, version, config, repeat)
+                full_result, full_faces, _ = reference[name]
+                times.append(seconds)
+                for key, value in full_result.items():
+                    if isinstance(value, bool):
+                        checks += 1
+                        if result[key] == value:
+                            agree += 1
+                        else:
+                            disagreements.append(f"{name}:{key}")
+                if faces.face_detected and full_faces.face_detected:
+                    ious.append(_iou(faces.main_box, full_faces.main_box))
+                for key, value in full_result["metrics"].items():
+                    other = result["metrics"][key]
+                    if isinstance(value, (int, float)) and value and other is not None:
+                        errors.setdefault(key, []).append(abs(other - value) / abs(value))
+
+            mean_time = statistics.fmean(times)
+            report[str(long_edge)] = {
+                "mean_s": mean_time,
+                "speedup": full_time / mean_time if mean_time else None,
+                "check_agreement": agree / checks if checks else None,
+                "disagreements": disagreements,
+                "main_box_iou": statistics.fmean(ious) if ious else None,
+                "metric_relative_error": {key: statistics.fmean(values) for key, values in errors.items()},
+            }
+    return report
+
+
+def bench_detectors(detectors: List[str], images: List[Tuple[str, bytes]], repeat: int = 5,
+                    detector_model: str = None) -> dict:
+    '''
+    Detection latency of each backend on the same decoded images, and its agreement with the
+    first backend: same face_detected, same face count and IoU of the main face box
+    detector_model: ONNX file of the yunet backend
+    '''
+    report = {}
+    with FaceQAEngine() as engine:
+        loaded = [(name, load_image(data)) for name, data in images]
+        reference = None
+        for name in detectors:
+            config = engine.config.replace(detector=name, detector_model=detector_model)
+            try:
+                # First call loads the model
+                start = time.perf_counter()
+                engine.detect_faces(loaded[0][1], None, config)
+                load_s = time.perf_counter() - start
+            except (ValueError, cv2.error) as e:
+                report[name] = {"error": str(e)}
+                continue
+
+            times, found = [], {}
+            for image_name, image in loaded:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    faces = engine.detect_faces(image, None, config)
+                    times.append(time.perf_counter() - start)
+                found[image_name] = faces
+            entry = {"first_call_s": load_s, "detection_s": _stats(times),
+                     "face_count": {image_name: len(faces) for image_name, faces in found.items()}}
+
+            if reference is None:
+                reference = (name, found)
+            else:
+                reference_name, reference_faces = reference
+                detected = count = 0
+                ious = []
+                for image_name, faces in found.items():
+                    other = reference_faces[image_name]
+                    detected += faces.face_detected == other.face_detected
+                    count += len(faces) == len(other)
+                    if faces.face_detected and other.face_detected:
+                        ious.append(_iou(faces.main_box, other.main_box))
+                entry["agreement"] = {
+                    "reference": reference_name,
+                    "face_detected": detected / len(found),
+                    "face_count": count / len(found),
+                    "main_box_iou": statistics.fmean(ious) if ious else None,
+                }
+            report[name] = entry
+    return report
+
+
+# Run in a fresh interpreter by bench_import(): argv is version, image path and "preload" or "lazy"
+_IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from face_qa.engine import FaceQAEngine
+report = {"import_s": time.perf_counter() - start}
+from face_qa.benchmark import _rss_bytes
+report["import_rss_bytes"] = _rss_bytes()
+start = time.perf_counter()
+engine = FaceQAEngine()
+if sys.argv[3] == "preload":
+    engine.preload()
+report["engine_init_s"] = time.perf_counter() - start
+start = time.perf_counter()
+engine.check(sys.argv[2], int(sys.argv[1]))
+report["first_check_s"] = time.perf_counter() - start
+report["rss_bytes"] = _rss_bytes()
+report["mediapipe_imported"] = "mediapipe" in sys.modules
+print(json.dumps(report))
+'''
+
+
+def _rss_bytes() -> int:
+    '''
+    Peak resident memory of this process, None where it can not be read
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_import(version: int, image_path: str) -> dict:
+    '''
+    Start time of a fresh process: import of face_qa, engine construction and first check,
+    with the models loaded on first use ("lazy") and up front ("preload"), and the peak resident memory
+    '''
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))}
+    report = {}
+    for mode in ("lazy", "preload"):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT, str(version), image_path, mode],
+                                   capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            report[mode] = {"error": completed.stderr.strip().splitlines()[-1:]}
+            continue
+        report[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+        report[mode]["process_s"] = time.perf_counter() - start
+    return report
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(versions: List[int] = (1, 2), resolutions: List[str] = tuple(RESOLUTIONS), repeat: int = 5,
+        workers: List[int] = None, throughput_count: int = 64, allocations: bool = False,
+        annotate: bool = False, analysis_edges: List[int] = None, corpus: str = None,
+        detectors: List[str] = None, detector_model: str = None) -> dict:
+    '''
+    corpus: Folder of images used instead of the bundled examples
+    analysis_edges: Analysis resolutions compared with the full resolution results
+    detectors: Detector backends compared with the first one, detector_model: ONNX file of yunet
+    '''
+    import mediapipe as mp
+
+    examples = bundled_images(corpus) if corpus else bundled_images()
+    base = next((data for name, data in examples if name.startswith('image_4')), examples[0][1] if examples else None)
+    images = examples + synthetic_images(list(resolutions), base)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "mediapipe": mp.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "annotate": annotate,
+        },
+        "versions": {},
+        "import": {},
+        "throughput_images_per_s": {},
+        "analysis": {},
+        "detectors": {},
+    }
+    with tempfile.TemporaryDirectory() as folder_path:
+        first_image = os.path.join(folder_path, images[0][0])
+        with open(first_image, 'wb') as image_file:
+            image_file.write(images[0][1])
+        for version in versions:
+            report["import"][str(version)] = bench_import(version, first_image)
+
+    for version in versions:
+        report["versions"][str(version)] = bench_version(version, images, repeat, allocations, annotate)
+        if workers:
+            report["throughput_images_per_s"][str(version)] = bench_throughput(version, images, workers, throughput_count)
+        if analysis_edges:
+            report["analysis"][str(version)] = bench_analysis(version, images, analysis_edges, repeat)
+    if detectors:
+        report["detectors"] = bench_detectors(detectors, images, repeat, detector_model)
+    return report
+
+
+def main(args):
+    workers = [int(w) for w in args.workers.split(',')] if args.workers else []
+    analysis_edges = [int(e) for e in args.analysis_edges.split(',')] if args.analysis_edges else []
+    detectors = args.detectors.split(',') if args.detectors else []
+    report = run(versions=args.versions, resolutions=args.resolutions.split(','), repeat=args.repeat,
+                 workers=workers, throughput_count=args.throughput_count,
+                 allocations=args.allocations, annotate=args.annotate,
+                 analysis_edges=analysis_edges, corpus=args.corpus,
+                 detectors=detectors, detector_model=args.detector_model)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
@@ -0,0 +1,136 @@
+from typing import Any, Mapping, Optional
+import collections
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+import os
+
+
+def config_fingerprint(config: Mapping) -> str:
+    '''
+    Short hash of the thresholds, so results computed with other settings are never reused
+    '''
+    return hashlib.blake2b(json.dumps(dict(config), sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def image_digest(image: Any) -> str:
+    '''
+    Hash of the image content (encoded bytes or decoded pixels)
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(image, np.ndarray):
+        digest.update(f"{image.shape}{image.dtype}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+    else:
+        digest.update(image)
+    return digest.hexdigest()
+
+
+def _to_native(result: dict) -> dict:
+    return {k: v.item() if isinstance(v, np.generic) else v for k, v in result.items()}
+
+
+class ResultCache():
+    '''
+    Cache of check results keyed by image content, detector version and configuration.
+
+    max_entries: Maximum number of results kept in memory (least recently used are evicted)
+    ttl: Seconds a result stays valid, forever if None
+    disk_path: Optional sqlite file used as a second tier that survives restarts
+    '''
+    def __init__(self, max_entries: int = 1024, ttl: float = None, disk_path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path is not None:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created REAL, result TEXT)")
+            self._disk.commit()
+
+    def key(self, image: Any, version: int, config: Mapping) -> str:
+        '''
+        image: Encoded image bytes or decoded np.ndarray
+        '''
+        return f"{image_digest(image)}:{version}:{config_fingerprint(config)}"
+
+    def get(self, key: str) -> Optional[dict]:
+        '''
+        Copy of the cached result, changing it does not change the cache
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, result = entry
+                if self.ttl is None or now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(result)
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute("SELECT created, result FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and (self.ttl is None or now - row[0] <= self.ttl):
+                    result = json.loads(row[1])
+                    self._store(key, row[0], result)
+                    self.disk_hits += 1
+                    return copy.deepcopy(result)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: dict):
+        # Stored as a copy, the caller keeps and may change its own result
+        result = copy.deepcopy(_to_native(result))
+        created = time.time()
+        with self._lock:
+            self._store(key, created, result)
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, created, json.dumps(result)))
+                self._disk.commit()
+
+    def _store(self, key: str, created: float, result: dict):
+        self._entries[key] = (created, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM results")
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+def read_image_bytes(image: Any) -> Any:
+    '''
+    Read paths into memory so the cache can hash their content, other sources are returned as is
+    '''
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as image_file:
+            return image_file.read()
+    return image
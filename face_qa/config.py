@@ -0,0 +1,270 @@
+'''
+Configuration of the checks.
+
+The configuration file is parsed and validated once into a read-only Config,
+shared by every FaceQA, engine and worker of the process through
+get_config_store(). The store checks the file modification time at most once
+per poll_interval and reloads it when it changed, so thresholds can be changed
+in production without restarting or draining the workers. An invalid file is
+logged and the previous configuration stays in use.
+
+Named profiles are kept in the "profiles" object of the file, each one only
+lists the values that differ from the base configuration:
+
+    "profiles": {"passport": {"face_center_threshold": 0.15}}
+'''
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import logging
+import threading
+import time
+import os
+from face_qa.stages import stage_order
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ConfigError(ValueError):
+    '''
+    Raised for an invalid configuration or an unknown profile
+    '''
+
+
+def _number(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("must be a number")
+    return value
+
+
+def _positive_int(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("must be a non-negative integer")
+    return value
+
+
+def _scale_factor(value) -> float:
+    if _number(value) <= 1:
+        raise ValueError("must be greater than 1")
+    return float(value)
+
+
+def _fraction(value) -> float:
+    if not 0 < _number(value) <= 1:
+        raise ValueError("must be greater than 0 and at most 1")
+    return float(value)
+
+
+def _size(value) -> Tuple[int, int]:
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError("must be a [width, height] pair")
+    return tuple(_positive_int(v) for v in value)
+
+
+def _optional(validator: Callable) -> Callable:
+    return lambda value: None if value is None else validator(value)
+
+
+def _boolean(value) -> bool:
+    if not isinstance(value, bool):
+        raise ValueError("must be true or false")
+    return value
+
+
+def _name(value) -> str:
+    if not isinstance(value, str) or not value:
+        raise ValueError("must be a non-empty string")
+    return value
+
+
+def _check_order(value) -> Tuple[str, ...]:
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("must be a list of stages")
+    stage_order(value)
+    return tuple(value)
+
+
+# Validator of each key and whether the key is required
+SCHEMA: Dict[str, Tuple[Callable, bool]] = {
+    "scale_factor_face_cascade": (_scale_factor, True),
+    "min_neighbors_face_cascade": (_positive_int, True),
+    "min_size_face_cascade": (_size, True),
+    "brightness_threshold": (_number, True),
+    "contrast_threshold": (_number, True),
+    # No longer used, eye_region_height sets the eye search band of the face box
+    "face_height_adcional": (_positive_int, False),
+    "eye_region_height": (_fraction, False),
+    "eye_area_threshold": (_number, True),
+    "smile_ratio_threshold": (_number, False),
+    "min_mouth_width": (_number, False),
+    "face_center_threshold": (_number, True),
+    "analysis_long_edge": (_optional(_positive_int), False),
+    "fast_decode": (_boolean, False),
+    "fail_fast": (_boolean, False),
+    "check_order": (_optional(_check_order), False),
+    "detector": (_optional(_name), False),
+    "detector_model": (_optional(_name), False),
+    "detector_score_threshold": (_optional(_number), False),
+}
+
+
+def validate(values: Mapping) -> Dict[str, Any]:
+    '''
+    Checked copy of values, lists become tuples
+    '''
+    unknown = [key for key in values if key not in SCHEMA]
+    if unknown:
+        raise ConfigError(f"Unknown config keys: {unknown}")
+    missing = [key for key, (_, required) in SCHEMA.items() if required and key not in values]
+    if missing:
+        raise ConfigError(f"Missing config keys: {missing}")
+
+    checked = {}
+    for key, value in values.items():
+        try:
+            checked[key] = SCHEMA[key][0](value)
+        except ValueError as e:
+            raise ConfigError(f"Invalid config value for {key}: {value!r} ({e})") from None
+    return checked
+
+
+class Config(Mapping):
+    '''
+    Validated read-only configuration, read as config["key"] or config.key
+    profile: Name of the profile it was built from, None for the base configuration
+    '''
+    __slots__ = ("_values", "profile")
+
+    def __init__(self, values: Mapping, profile: str = None):
+        object.__setattr__(self, "_values", validate(values))
+        object.__setattr__(self, "profile", profile)
+
+    def __getitem__(self, key: str):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getattr__(self, key: str):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Config is read-only, use replace()")
+
+    def __reduce__(self):
+        return (Config, (dict(self._values), self.profile))
+
+    def __repr__(self) -> str:
+        return f"Config({self._values!r}, profile={self.profile!r})"
+
+    def replace(self, **changes) -> 'Config':
+        '''
+        Validated copy with some values changed
+        '''
+        return Config({**self._values, **changes}, self.profile)
+
+
+class ConfigStore():
+    '''
+    Configuration file with its profiles, reloaded when the file changes.
+
+    path: JSON file
+    poll_interval: Minimum seconds between two checks of the file modification time
+    '''
+    def __init__(self, path: str, poll_interval: float = 1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._checked = time.monotonic()
+        self._configs = self._read()
+
+    def _read(self) -> Dict[Optional[str], Config]:
+        with open(self.path, 'r') as config_file:
+            try:
+                data = json.load(config_file)
+            except json.JSONDecodeError as e:
+                raise ConfigError(f"Invalid JSON in {self.path}: {e}") from None
+        profiles = data.pop("profiles", {})
+
+        configs = {None: Config(data)}
+        for name, overrides in profiles.items():
+            configs[name] = Config({**data, **overrides}, name)
+        return configs
+
+    def get(self, profile: str = None) -> Config:
+        '''
+        Current configuration of profile, the base configuration if None
+        '''
+        self._poll()
+        try:
+            return self._configs[profile]
+        except KeyError:
+            raise ConfigError(f"Unknown config profile: {profile}") from None
+
+    @property
+    def profiles(self) -> List[str]:
+        return [name for name in self._configs if name is not None]
+
+    def _poll(self):
+        if time.monotonic() - self._checked < self.poll_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked < self.poll_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            # Remember the new time even when the file is invalid, it is read again on its next change
+            self._mtime = mtime
+            try:
+                self._configs = self._read()
+                logger.info("Reloaded configuration from %s", self.path)
+            except (OSError, ValueError) as e:
+                logger.error("Keeping the previous configuration, %s", e)
+
+
+def resolve_config_path(config_path: str) -> str:
+    '''
+    config_path relative to the face_qa package ('/config.json'), or any other file path
+    '''
+    packaged = os.path.join(PACKAGE_DIR, config_path.lstrip('/\\'))
+    return packaged if os.path.isfile(packaged) else config_path
+
+
+_stores: Dict[str, ConfigStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_config_store(config_path: str = '/config.json') -> ConfigStore:
+    '''
+    Shared store of the configuration file, created on first use
+    '''
+    path = os.path.abspath(resolve_config_path(config_path))
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(path)
+            if store is None:
+                store = _stores[path] = ConfigStore(path)
+    return store
+
+
+def load_config(config_path: str = '/config.json', profile: str = None) -> Config:
+    '''
+    Current configuration of the file, see get_config_store()
+    '''
+    return get_config_store(config_path).get(profile)
@@ -0,0 +1,65 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+Box = Tuple[int, int, int, int]
+Point = Tuple[float, float]
+
+class FaceContext():
+    '''
+    Faces found by the detection stage, shared by every check that follows it.
+    boxes: (x, y, w, h) of each face in image pixels
+    scores: Detector confidence of each face (None when the detector has no score)
+    keypoints: Detector key points of each face in image pixels (empty when the detector has none)
+    The faces are kept sorted by box area, the biggest face first, unless sort is False.
+    '''
+    def __init__(self, boxes: Sequence[Box], scores: Sequence[Optional[float]] = None, keypoints: Sequence[List[Point]] = None,
+                 sort: bool = True):
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        scores = list(scores) if scores is not None else [None] * len(boxes)
+        keypoints = list(keypoints) if keypoints is not None else [[] for _ in boxes]
+
+        order = range(len(boxes))
+        if sort:
+            order = sorted(order, key=lambda i: boxes[i][2] * boxes[i][3], reverse=True)
+        self.boxes = [boxes[i] for i in order]
+        self.scores = [scores[i] for i in order]
+        self.keypoints = [keypoints[i] for i in order]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def face_detected(self) -> bool:
+        return len(self.boxes) > 0
+
+    @property
+    def more_than_one_face(self) -> bool:
+        return len(self.boxes) > 1
+
+    @property
+    def main_box(self) -> Box:
+        return self.boxes[0]
+
+    def scaled(self, factor: float) -> 'FaceContext':
+        '''
+        Same faces with the boxes and key points multiplied by factor,
+        e.g. to map detections on a reduced copy back to the original image.
+        The faces keep their order, index i is the same face in both contexts even when rounding changes the areas.
+        '''
+        if factor == 1.0:
+            return self
+        boxes = [tuple(round(v * factor) for v in box) for box in self.boxes]
+        keypoints = [[(px * factor, py * factor) for px, py in points] for points in self.keypoints]
+        return FaceContext(boxes, self.scores, keypoints, sort=False)
+
+    def roi(self, array: np.ndarray, index: int = 0, margin: float = 0.0) -> Tuple[np.ndarray, Tuple[int, int]]:
+        '''
+        View (not a copy) of the face region of array, clipped to the image borders.
+        margin: Fraction of the box size added on each side
+        Returns the view and its (x, y) offset in the image
+        '''
+        x, y, w, h = self.boxes[index]
+        mx, my = int(w * margin), int(h * margin)
+        x0, y0 = max(x - mx, 0), max(y - my, 0)
+        x1, y1 = min(x + w + mx, array.shape[1]), min(y + h + my, array.shape[0])
+        return array[y0:y1, x0:x1], (x0, y0)
@@ -0,0 +1,229 @@
+'''
+Near-duplicate detection with perceptual hashes.
+
+A perceptual hash is a 64 bit summary of the gray levels of a heavily reduced
+image. Re-encoded, resized or slightly re-exposed copies of one photo get hashes
+a few bits apart, so near-duplicates are the images whose hashes are within a
+small Hamming distance. BKTree finds them without comparing with every image.
+
+NearDuplicateIndex sits in front of the checks (FaceQAEngine(near_duplicates=...)):
+an image close enough to one already scored gets the stored measurements, evaluated
+with the current thresholds, instead of running detection again.
+
+dedupe_report() groups the near-duplicate images of a directory tree.
+'''
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import collections
+import copy
+import threading
+import cv2
+import numpy as np
+from face_qa.cache import config_fingerprint
+from face_qa.image_loader import load_image
+from face_qa.scan import DEFAULT_PATTERNS, scan_images
+
+# Long edge the images are decoded at for dedupe_report(), the hashes only need a few pixels
+REPORT_LONG_EDGE = 64
+
+
+def dhash(gray: np.ndarray) -> int:
+    '''
+    Difference hash: sign of the horizontal gradient on a 9x8 reduction
+    '''
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray: np.ndarray) -> int:
+    '''
+    DCT hash: lowest 8x8 frequencies of a 32x32 reduction compared with their median
+    '''
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    # The DC term only holds the mean brightness
+    return _to_int(low > np.median(low[1:]))
+
+
+def _to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+HASHES: Dict[str, Callable[[np.ndarray], int]] = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree():
+    '''
+    Burkhard-Keller tree of hashes under the Hamming distance.
+    A search only visits the subtrees whose distance to the visited node can hold a match.
+    '''
+    def __init__(self):
+        # Node: [hash, value, {distance: child}]
+        self._root = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: int, value: Any):
+        node = [key, value, {}]
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, Any]]:
+        '''
+        (distance, value) of every hash within max_distance of key, closest first
+        '''
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            stack.extend(child for edge, child in node[2].items()
+                         if distance - max_distance <= edge <= distance + max_distance)
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+class NearDuplicateIndex():
+    '''
+    Measurements of the images scored so far, found again by perceptual hash.
+
+    max_distance: Maximum Hamming distance (out of 64 bits) between two near-duplicates
+    method: "dhash" or "phash"
+    max_entries: Oldest images are forgotten beyond it
+    max_aspect_change: Relative aspect ratio difference above which two images are never duplicates (crops)
+
+    Measurements are only shared between checks with the same version and measurement settings.
+    Pixel measurements (eye area, mouth width) are scaled to the size of the new image.
+    '''
+    def __init__(self, max_distance: int = 4, method: str = "dhash", max_entries: int = 100000,
+                 max_aspect_change: float = 0.02):
+        if method not in HASHES:
+            raise ValueError(f"Unknown hash method: {method}")
+        self.max_distance = max_distance
+        self.method = method
+        self.max_entries = max_entries
+        self.max_aspect_change = max_aspect_change
+        self.hits = 0
+        self.misses = 0
+        self._hash = HASHES[method]
+        self._entries = collections.deque()
+        self._trees: Dict[Tuple[int, str], BKTree] = {}
+        self._lock = threading.Lock()
+
+    def hash(self, gray: np.ndarray) -> int:
+        return self._hash(gray)
+
+    def lookup(self, key: int, size: Tuple[int, int], version: int, settings: dict) -> Optional[dict]:
+        '''
+        Metrics of the closest near-duplicate, None if there is none
+        key: Hash of the image, size: its (width, height) in original pixels
+        settings: Measurement settings of the check (metrics.measurement_config)
+        '''
+        with self._lock:
+            tree = self._trees.get((version, config_fingerprint(settings)))
+            matches = tree.search(key, self.max_distance) if tree is not None else []
+            for _, (stored_size, metrics) in matches:
+                if _aspect_change(size, stored_size) <= self.max_aspect_change:
+                    self.hits += 1
+                    return _rescale(metrics, max(size) / max(stored_size))
+            self.misses += 1
+            return None
+
+    def add(self, key: int, size: Tuple[int, int], version: int, settings: dict, metrics: dict):
+        with self._lock:
+            # Stored as a copy, the caller keeps and may change its own metrics
+            tree_key, value = (version, config_fingerprint(settings)), (size, copy.deepcopy(metrics))
+            self._entries.append((tree_key, key, value))
+            self._trees.setdefault(tree_key, BKTree()).add(key, value)
+            if len(self._entries) > self.max_entries:
+                self._forget()
+
+    def _forget(self):
+        # A BK-tree can not drop nodes, the oldest quarter is forgotten and the trees rebuilt
+        for _ in range(max(1, len(self._entries) // 4)):
+            self._entries.popleft()
+        self._trees = {}
+        for tree_key, key, value in self._entries:
+            self._trees.setdefault(tree_key, BKTree()).add(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._trees = {}
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def _aspect_change(size: Tuple[int, int], other: Tuple[int, int]) -> float:
+    aspect, other_aspect = size[0] / size[1], other[0] / other[1]
+    return abs(aspect - other_aspect) / other_aspect
+
+
+def _rescale(metrics: dict, ratio: float) -> dict:
+    '''
+    Copy of stored metrics with the pixel measurements scaled by ratio
+    '''
+    metrics = copy.deepcopy(metrics)
+    if ratio != 1.0:
+        if metrics.get('eye_contour_area') is not None:
+            metrics['eye_contour_area'] *= ratio ** 2
+        if metrics.get('mouth_width') is not None:
+            metrics['mouth_width'] *= ratio
+    return metrics
+
+
+def dedupe_report(root: str, max_distance: int = 4, method: str = "dhash",
+                  include: Sequence[str] = DEFAULT_PATTERNS, exclude: Sequence[str] = ()) -> dict:
+    '''
+    Groups of near-duplicate images under root.
+    Each image is decoded at a tiny size (JPEGs with libjpeg scaling) and hashed once,
+    and its near-duplicates are found in a BK-tree of the images hashed before it.
+    Returns {"images": count, "errors": [...], "groups": [[path, ...], ...]}, biggest group first
+    '''
+    hash_image = HASHES[method]
+    tree = BKTree()
+    parents: Dict[str, str] = {}
+    errors = []
+
+    def find(path: str) -> str:
+        while parents[path] != path:
+            parents[path] = parents[parents[path]]
+            path = parents[path]
+        return path
+
+    for path in scan_images(root, include, exclude):
+        try:
+            image = load_image(path, long_edge=REPORT_LONG_EDGE, grayscale=True)
+            gray, _ = image.reduced(REPORT_LONG_EDGE)
+            key = hash_image(gray.gray)
+        except ValueError as e:
+            errors.append({"input": path, "error": str(e)})
+            continue
+        parents[path] = path
+        for _, other in tree.search(key, max_distance):
+            parents[find(other)] = find(path)
+        tree.add(key, path)
+
+    groups = collections.defaultdict(list)
+    for path in parents:
+        groups[find(path)].append(path)
+    duplicates = sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda g: (-len(g), g[0]))
+    return {"images": len(parents), "errors": errors, "groups": duplicates}
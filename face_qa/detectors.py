@@ -0,0 +1,161 @@
+'''
+Face detector backends of the detection stage.
+
+The backend is chosen by the "detector" key of the configuration (base file, a
+profile or the config given to check()), and by the version argument when the
+key is not set: version 1 is "haar", version 2 is "blazeface". Every backend
+returns a FaceContext: boxes, scores and key points in pixels of the image it
+was given, so the checks after detection do not depend on the backend.
+
+Built-in backends:
+- haar: OpenCV Haar cascade, tuned by the *_face_cascade settings
+- blazeface: MediaPipe BlazeFace short range
+- yunet: OpenCV DNN YuNet (cv2.FaceDetectorYN), from the ONNX file of "detector_model".
+  Its faces are kept above "detector_score_threshold"
+
+Other backends are added with register_detector().
+'''
+from typing import TYPE_CHECKING, Callable, Dict, Mapping
+import cv2
+import os
+from face_qa.context import FaceContext
+from face_qa.image_loader import LoadedImage
+
+if TYPE_CHECKING:
+    from face_qa.engine import FaceQAEngine
+
+MODELS_DIR = os.path.dirname(__file__) + '/models'
+
+# Backend of each version when the configuration has no "detector"
+VERSION_DETECTORS = {1: "haar", 2: "blazeface"}
+
+# Faces kept by the detectors with a score, when "detector_score_threshold" is not set
+DEFAULT_SCORE_THRESHOLD = 0.6
+
+
+def load_mediapipe():
+    '''
+    mediapipe, imported on first use. Its import and TensorFlow Lite setup take most of the
+    start time of a process, and only BlazeFace (version 2) and FaceMesh (smile) need it.
+    '''
+    import mediapipe
+    return mediapipe
+
+
+class DetectorBackend():
+    '''
+    One face detector, created by an engine the first time a check selects it and then reused.
+    detect() runs under the engine lock, a backend is never called from two threads at once.
+    grayscale: Only image.gray is read, a fail-fast check then skips decoding the colors
+    '''
+    grayscale = False
+
+    def detect(self, image: LoadedImage, config: Mapping) -> FaceContext:
+        '''
+        Faces of image, boxes and key points in its pixels (image.scale is its size relative to the original file)
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HaarDetector(DetectorBackend):
+    '''
+    Using HaarCascade to Face Classification
+    '''
+    grayscale = True
+
+    def __init__(self, engine: 'FaceQAEngine', config: Mapping):
+        self.cascade = engine.face_cascade
+
+    def detect(self, image: LoadedImage, config: Mapping) -> FaceContext:
+        # The minimum face size is given in original pixels
+        min_size = tuple(max(1, round(v * image.scale)) for v in config["min_size_face_cascade"])
+        faces = self.cascade.detectMultiScale(image.gray, scaleFactor=config["scale_factor_face_cascade"],
+                                              minNeighbors=config["min_neighbors_face_cascade"], minSize=min_size)
+        return FaceContext(faces)
+
+
+class BlazeFaceDetector(DetectorBackend):
+    '''
+    Using MediaPipe to Face Classification
+    The graph is the engine one (FaceQAEngine.face_detector), shared with preload() and close()
+    '''
+    def __init__(self, engine: 'FaceQAEngine', config: Mapping):
+        self.engine = engine
+
+    def detect(self, image: LoadedImage, config: Mapping) -> FaceContext:
+        mp = load_mediapipe()
+        rgb = image.rgb
+        face_detector_result = self.engine._detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb))
+
+        img_h, img_w = rgb.shape[:2]
+        boxes, scores, keypoints = [], [], []
+        for detection in face_detector_result.detections:
+            bbox = detection.bounding_box
+            boxes.append((bbox.origin_x, bbox.origin_y, bbox.width, bbox.height))
+            scores.append(detection.categories[0].score if detection.categories else None)
+            keypoints.append([(kp.x * img_w, kp.y * img_h) for kp in detection.keypoints or []])
+
+        return FaceContext(boxes, scores, keypoints)
+
+
+class YuNetDetector(DetectorBackend):
+    '''
+    Using the OpenCV DNN YuNet model to Face Classification
+    Key points: right eye, left eye, nose tip, right and left mouth corners
+    '''
+    def __init__(self, engine: 'FaceQAEngine', config: Mapping):
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise ValueError("The yunet detector needs OpenCV 4.5.4 or newer (cv2.FaceDetectorYN)")
+        model_path = config.get("detector_model")
+        if not model_path:
+            raise ValueError('The yunet detector needs "detector_model", the path of its ONNX file')
+        if not os.path.isfile(model_path):
+            model_path = os.path.join(MODELS_DIR, model_path)
+            if not os.path.isfile(model_path):
+                raise ValueError(f"YuNet model not found: {config['detector_model']}")
+        # The input size is set again for every image
+        self.model = cv2.FaceDetectorYN.create(model_path, "", (320, 320), DEFAULT_SCORE_THRESHOLD)
+
+    def detect(self, image: LoadedImage, config: Mapping) -> FaceContext:
+        bgr = image.bgr
+        self.model.setInputSize((bgr.shape[1], bgr.shape[0]))
+        threshold = config.get("detector_score_threshold")
+        self.model.setScoreThreshold(DEFAULT_SCORE_THRESHOLD if threshold is None else threshold)
+        _, faces = self.model.detect(bgr)
+        if faces is None:
+            return FaceContext([])
+        # Each row: x, y, w, h, 5 key points (x, y) and the score
+        boxes = [face[:4] for face in faces]
+        keypoints = [[(float(face[i]), float(face[i + 1])) for i in range(4, 14, 2)] for face in faces]
+        return FaceContext(boxes, [float(face[14]) for face in faces], keypoints)
+
+
+# Factory of each backend, called with the engine and the configuration of the first check using it
+DETECTORS: Dict[str, Callable[['FaceQAEngine', Mapping], DetectorBackend]] = {
+    "haar": HaarDetector,
+    "blazeface": BlazeFaceDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def register_detector(name: str, factory: Callable[['FaceQAEngine', Mapping], DetectorBackend]):
+    '''
+    Make a backend selectable with "detector": name
+    factory: Called with the engine and the configuration, returns the DetectorBackend
+    '''
+    DETECTORS[name] = factory
+
+
+def detector_name(version: int, config: Mapping) -> str:
+    '''
+    Backend selected by config["detector"], or by version when it is not set
+    '''
+    name = config.get("detector") or VERSION_DETECTORS.get(version)
+    if name is None:
+        raise ValueError(f"Unknown face classificator version: {version}")
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown face detector: {name}")
+    return name
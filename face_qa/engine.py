@@ -0,0 +1,501 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Mapping, Optional, Tuple
+import threading
+import time
+import cv2
+import numpy as np
+import os
+from face_qa.annotation import AnnotationSink, Annotations
+from face_qa.cache import ResultCache, read_image_bytes
+from face_qa.config import Config, get_config_store
+from face_qa.context import FaceContext
+from face_qa.detectors import DETECTORS, MODELS_DIR, DetectorBackend, detector_name, load_mediapipe
+from face_qa.image_loader import ImageSource, LoadedImage, load_image
+from face_qa.metrics import (STAGE_CHECKS, empty_face_metrics, empty_metrics, evaluate, evaluate_face, failed_checks,
+                             measurement_config)
+from face_qa.result import FaceResult, QAResult
+from face_qa.stages import FULL_ORDER, StageTimer, stage_order
+
+if TYPE_CHECKING:
+    import mediapipe as mp
+
+# Margin around the face box given to FaceMesh
+SMILE_ROI_MARGIN = 0.25
+
+EYE_CASCADE_PATH = MODELS_DIR + '/haarcascade_eye.xml'
+
+# Upper fraction of the face box searched for eyes, when "eye_region_height" is not set
+DEFAULT_EYE_REGION_HEIGHT = 0.5
+
+class FaceQAEngine():
+    '''
+    Long-lived holder of every model used by the checks.
+    The cascades are loaded in the constructor, the BlazeFace detector and the FaceMesh
+    graph (and mediapipe itself) the first time a check needs them, or all at once by
+    preload(). Every model is then reused by each call to check().
+
+    config_path: Configuration file used when check() receives no config, reloaded when it changes
+    cache: ResultCache consulted before running the checks, no caching if None
+    near_duplicates: face_qa.dedupe.NearDuplicateIndex consulted after decoding, the measurements of a
+    near-duplicate of an image already scored are reused instead of running the checks
+    '''
+    # Smallest eye searched for, relative to the face width (0 searches every size)
+    eye_min_size = 0.0
+    # Threads measuring the faces of check_faces()
+    face_workers = min(4, os.cpu_count() or 1)
+
+    def __init__(self, config_path: str = '/config.json', cache: ResultCache = None, near_duplicates=None):
+        self.config_store = get_config_store(config_path)
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        # Creates the StageTimer that records the stages of each check() call
+        self.timer_factory = StageTimer
+        # face_qa.monitoring.StageHook called around the stages of each check() call
+        self.hooks = []
+
+        # Haarcascade models
+        self.face_cascade = cv2.CascadeClassifier(MODELS_DIR + '/haarcascade_frontalface_default.xml')
+        self.eye_cascade = cv2.CascadeClassifier(EYE_CASCADE_PATH)
+        # A CascadeClassifier can not be called from two threads at once,
+        # each thread of the face pool loads its own eye cascade
+        self._thread_models = threading.local()
+
+        # MediaPipe BlazeFace detector and FaceMesh graph, created on first use
+        self._face_detector = None
+        self._face_mesh = None
+        self._models_lock = threading.Lock()
+        # face_qa.detectors backends by (name, model file), created on first use
+        self._detectors = {}
+
+        # MediaPipe graphs are not safe to share between threads
+        self._lock = threading.Lock()
+        # Threads measuring the faces of check_faces(), started on first use
+        self._face_pool = None
+
+    @property
+    def face_detector(self):
+        if self._face_detector is None:
+            with self._models_lock:
+                if self._face_detector is None:
+                    self._face_detector = self._create_face_detector()
+        return self._face_detector
+
+    @property
+    def face_mesh(self):
+        if self._face_mesh is None:
+            with self._models_lock:
+                if self._face_mesh is None:
+                    self._face_mesh = self._create_face_mesh()
+        return self._face_mesh
+
+    def preload(self) -> 'FaceQAEngine':
+        '''
+        Load every model now instead of on first use, e.g. before a server takes its first request
+        '''
+        self.face_detector, self.face_mesh
+        if self.config.get("detector"):
+            self.detector(None, self.config)
+        return self
+
+    def detector(self, version: int, config: Mapping) -> DetectorBackend:
+        '''
+        Detector backend of the checks of version with config (see face_qa.detectors), created on first use
+        '''
+        name = detector_name(version, config)
+        key = (name, config.get("detector_model"))
+        backend = self._detectors.get(key)
+        if backend is None:
+            with self._models_lock:
+                backend = self._detectors.get(key)
+                if backend is None:
+                    backend = self._detectors[key] = DETECTORS[name](self, config)
+        return backend
+
+    def _create_face_detector(self):
+        mp = load_mediapipe()
+        BaseOptions = mp.tasks.BaseOptions
+        FaceDetector = mp.tasks.vision.FaceDetector
+        FaceDetectorOptions = mp.tasks.vision.FaceDetectorOptions
+        VisionRunningMode = mp.tasks.vision.RunningMode
+
+        options = FaceDetectorOptions(
+            base_options=BaseOptions(model_asset_path=MODELS_DIR + '/blaze_face_short_range.tflite'),
+            running_mode=VisionRunningMode.IMAGE)
+        return FaceDetector.create_from_options(options)
+
+    def _create_face_mesh(self):
+        mp = load_mediapipe()
+        return mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
+
+    def close(self):
+        '''
+        Release the MediaPipe graphs and the detector backends
+        '''
+        for backend in self._detectors.values():
+            backend.close()
+        self._detectors = {}
+        if self._face_detector is not None:
+            self._face_detector.close()
+            self._face_detector = None
+        if self._face_mesh is not None:
+            self._face_mesh.close()
+            self._face_mesh = None
+        if self._face_pool is not None:
+            self._face_pool.shutdown()
+            # Started again by the next check_faces()
+            self._face_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def config(self) -> Config:
+        '''
+        Current base configuration of the config file
+        '''
+        return self.config_store.get()
+
+    def add_hook(self, hook):
+        '''
+        hook: face_qa.monitoring.StageHook called around the stages of every following check()
+        '''
+        self.hooks = self.hooks + [hook]
+
+    def remove_hook(self, hook):
+        self.hooks = [other for other in self.hooks if other is not hook]
+
+    def check(self, image: ImageSource, version: int, config: Mapping = None, annotate: AnnotationSink = None,
+              profile: str = None) -> QAResult:
+        '''
+        image: Image file path, encoded image bytes or decoded BGR np.ndarray
+        version: Face Classificator 1: haarcascade 2: mediapipe BlazeFace, unless config["detector"] selects another backend
+        config: Thresholds to use instead of the engine configuration file
+        annotate: Sink receiving the annotated images, nothing is drawn when None
+        profile: Named profile of the configuration file ("passport", "selfie", ...)
+        '''
+        hooks = self.hooks
+        if not hooks:
+            return self._check(image, version, config, annotate, profile, self.timer_factory())
+
+        start = time.perf_counter()
+        try:
+            result = self._check(image, version, config, annotate, profile, self.timer_factory(hooks))
+        except Exception as e:
+            for hook in hooks:
+                hook.check_finished(version, None, time.perf_counter() - start, e)
+            raise
+        seconds = time.perf_counter() - start
+        for hook in hooks:
+            hook.check_finished(version, result, seconds, None)
+        return result
+
+    def _check(self, image: ImageSource, version: int, config: Mapping, annotate: AnnotationSink, profile: str,
+               timer: StageTimer) -> QAResult:
+        config = config if config is not None else self.config_store.get(profile)
+
+        # The metrics only depend on the measurement settings, cached metrics are
+        # evaluated again with the current thresholds. Annotated checks always run.
+        key = None
+        if self.cache is not None and annotate is None:
+            with timer.stage("cache"):
+                image = read_image_bytes(image)
+                key = self.cache.key(image.bgr if isinstance(image, LoadedImage) else image, version, measurement_config(config))
+                cached = self.cache.get(key)
+            if cached is not None:
+                return QAResult.from_checks(evaluate(cached['metrics'], config), cached['metrics'], timer.timings)
+
+        annotations = annotate.begin() if annotate is not None else None
+        # Decode once, every check shares the same pixel buffer
+        with timer.stage("decode"):
+            image = self.decode(image, version, config, annotations)
+
+        near_duplicate = None
+        if self.near_duplicates is not None and annotations is None:
+            with timer.stage("dedupe"):
+                # Hashed on the gray working copy the brightness and contrast stages use anyway
+                working, _ = image.reduced(config.get("analysis_long_edge"))
+                height, width = image.shape[:2]
+                near_duplicate = (self.near_duplicates.hash(working.gray),
+                                  (round(width / image.scale), round(height / image.scale)),
+                                  version, measurement_config(config))
+                reused = self.near_duplicates.lookup(*near_duplicate)
+            if reused is not None:
+                return QAResult.from_checks(evaluate(reused, config), reused, timer.timings)
+
+        with self._lock:
+            metrics = self.measure(image, version, config, annotations, timer)
+
+        collected = None
+        if annotations is not None:
+            with timer.stage("annotation"):
+                collected = annotations.collect()
+        if key is not None:
+            self.cache.put(key, {'metrics': metrics})
+        if near_duplicate is not None:
+            self.near_duplicates.add(*near_duplicate, metrics)
+        return QAResult.from_checks(evaluate(metrics, config), metrics, timer.timings, collected)
+
+    def decode(self, image: ImageSource, version: int, config: Mapping, annotations: Annotations = None) -> LoadedImage:
+        '''
+        Decode stage. With config["fast_decode"] a big JPEG is decoded at the smallest 1/2, 1/4 or 1/8
+        size that still covers config["analysis_long_edge"], and a fail-fast check with a gray level detector
+        (Haar) reads only the gray levels, the colors are decoded if the smile stage is reached.
+        Annotated checks always decode the full image.
+        '''
+        if not config.get("fast_decode", False) or annotations is not None:
+            return load_image(image)
+        grayscale = config.get("fail_fast", False) and self.detector(version, config).grayscale
+        return load_image(image, config.get("analysis_long_edge"), grayscale)
+
+    def measure(self, image: LoadedImage, version: int, config: Mapping = None, annotations: Annotations = None,
+                timer: StageTimer = None) -> dict:
+        '''
+        Raw measurements of the image, without comparing them to the thresholds (see metrics.evaluate)
+        timer: Records the time of each stage
+        With config["fail_fast"] the stages run in config["check_order"] (cheapest first by default)
+        and stop at the first failing check, the remaining checks are listed in metrics["skipped"].
+        '''
+        config = config if config is not None else self.config
+        timer = timer if timer is not None else self.timer_factory()
+        fail_fast = config.get("fail_fast", False)
+        order = stage_order(config.get("check_order")) if fail_fast else FULL_ORDER
+
+        # Detection, FaceMesh and the global statistics run on the reduced working copy,
+        # boxes and landmarks are always reported in original image pixels
+        working, scale = image.reduced(config.get("analysis_long_edge"))
+        metrics = empty_metrics(None)
+        faces = None
+        for position, stage in enumerate(order):
+            with timer.stage(stage):
+                if stage == "detection":
+                    # Faces are detected once, the other checks work on the detected boxes
+                    faces = self.detect_faces(image, version, config)
+                    metrics['face_count'] = len(faces)
+                elif stage == "eyes":
+                    metrics['eye_contour_area'] = self._eye_contour_area(image, faces, config, annotations)
+                elif stage == "smile":
+                    metrics['mouth_width'], metrics['smile_ratio'] = self._mouth_measures(image, faces, annotations, working, scale)
+                elif stage == "contrast":
+                    metrics['contrast'] = self._contrast(working.gray, annotations)
+                elif stage == "brightness":
+                    metrics['brightness'] = self._brightness(working.gray, annotations)
+                elif stage == "centering":
+                    metrics['face_center_offset'] = self._face_center_offset(image, faces, annotations)
+
+            if stage == "detection" and not faces.face_detected:
+                break
+            if fail_fast and failed_checks(metrics, config, STAGE_CHECKS[stage]):
+                metrics['skipped'] = [name for later in order[position + 1:] for name in STAGE_CHECKS[later]]
+                break
+
+        return metrics
+
+    def check_faces(self, image: ImageSource, version: int, config: Mapping = None, profile: str = None) -> List[FaceResult]:
+        '''
+        Multi-face mode: every detected face is measured and checked, the biggest first.
+        Brightness and contrast are those of each face region. The eyes and the photometric
+        measures of the faces run in parallel on views of the shared pixel buffer.
+        image: Image file path, encoded image bytes or decoded BGR np.ndarray
+        version: Face Classificator 1: haarcascade 2: mediapipe BlazeFace
+        '''
+        config = config if config is not None else self.config_store.get(profile)
+        image = self.decode(image, version, config)
+        working, scale = image.reduced(config.get("analysis_long_edge"))
+        # Convert once before the faces are measured from several threads
+        image.gray, working.gray, working.rgb
+
+        with self._lock:
+            faces = self.detect_faces(image, version, config)
+            working_faces = faces.scaled(scale)
+            measured = [self._face_executor().submit(self._measure_face, image, working, faces, working_faces, config, i)
+                        for i in range(len(faces))]
+            # FaceMesh is one graph, the mouths are measured here while the pool works on the rest
+            mouths = [self._mouth_measures(image, faces, None, working, scale, i) for i in range(len(faces))]
+
+            results = []
+            for i, future in enumerate(measured):
+                metrics = future.result()
+                metrics['mouth_width'], metrics['smile_ratio'] = mouths[i]
+                box = faces.scaled(1 / image.scale).boxes[i]
+                results.append(FaceResult(box, faces.scores[i], **evaluate_face(metrics, config), metrics=metrics))
+        return results
+
+    def _measure_face(self, image: LoadedImage, working: LoadedImage, faces: FaceContext, working_faces: FaceContext,
+                      config: dict, index: int) -> dict:
+        metrics = empty_face_metrics()
+        metrics['eye_contour_area'] = self._eye_contour_area(image, faces, config, index=index)
+        metrics['face_center_offset'] = self._face_center_offset(image, faces, index=index)
+        face_gray, _ = working_faces.roi(working.gray, index)
+        metrics['brightness'] = self._brightness(face_gray)
+        metrics['contrast'] = self._contrast(face_gray)
+        return metrics
+
+    def _face_executor(self) -> ThreadPoolExecutor:
+        if self._face_pool is None:
+            self._face_pool = ThreadPoolExecutor(max_workers=self.face_workers, thread_name_prefix="face-qa-face",
+                                                 initializer=self._load_thread_models)
+        return self._face_pool
+
+    def _load_thread_models(self):
+        self._thread_models.eye_cascade = cv2.CascadeClassifier(EYE_CASCADE_PATH)
+
+    def _eye_cascade(self) -> cv2.CascadeClassifier:
+        # Outside the face pool the cascade is only used under self._lock
+        return getattr(self._thread_models, "eye_cascade", self.eye_cascade)
+
+    def detect_faces(self, image: LoadedImage, version: int, config: Mapping = None) -> FaceContext:
+        '''
+        Face detection stage, runs the backend selected by config["detector"] or by version
+        version: Face Classificator 1: haarcascade 2: mediapipe BlazeFace
+        The detector runs on a copy reduced to config["analysis_long_edge"] when the image is bigger,
+        the returned boxes are in pixels of image (divide by image.scale for the original file pixels).
+        '''
+        config = config if config is not None else self.config
+        working, scale = image.reduced(config.get("analysis_long_edge"))
+        return self.detector(version, config).detect(working, config).scaled(1 / scale)
+
+    def _detect(self, mp_image: 'mp.Image'):
+        return self.face_detector.detect(mp_image)
+
+    def _face_center_offset(self, image: LoadedImage, faces: FaceContext, annotations: Annotations = None, index: int = 0) -> float:
+        '''
+        Using np to verify
+        Distance between the face and image centers, relative to the image height
+        '''
+        x, y, w, h = faces.boxes[index]
+
+        # Check if the face image is centered
+        face_center = (x + w // 2, y + h // 2)
+        image_center = (image.shape[1] // 2, image.shape[0] // 2)
+        distance = np.sqrt((face_center[0] - image_center[0]) ** 2 + (face_center[1] - image_center[1]) ** 2)
+
+        # Draw center
+        if annotations is not None:
+            annotated = image.bgr.copy()
+            cv2.circle(annotated, face_center, 5, (0, 255, 0), -1)
+            cv2.circle(annotated, image_center, 5, (255, 0, 0), -1)
+            annotations.add("center", annotated)
+
+        return float(distance / image.shape[0])
+
+    def _brightness(self, gray, annotations: Annotations = None) -> float:
+        '''
+        Using cv2 to verify
+        '''
+        brightness = cv2.mean(gray)[0]
+        if annotations is not None:
+            annotated = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+            cv2.putText(annotated, f"Brightness: {brightness:.2f}", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (0,0,255), 6)
+            annotations.add("brightness", annotated)
+        return float(brightness)
+
+    def _contrast(self, gray, annotations: Annotations = None) -> float:
+        contrast = cv2.meanStdDev(gray)[1][0][0]  # Extração correta do valor escalar
+        if annotations is not None:
+            annotated = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+            cv2.putText(annotated, f"Contrast: {contrast:.2f}", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (0,0,255), 6)
+            annotations.add("contrast", annotated)
+        return float(contrast)
+
+    def _eye_contour_area(self, image: LoadedImage, faces: FaceContext, config: dict, annotations: Annotations = None,
+                          index: int = 0) -> float:
+        '''
+        Using HaarCascade to Eyes Classification
+        Biggest dark contour area found in the two biggest eyes, in original image pixels
+        '''
+        face_gray, _ = faces.roi(image.gray, index)
+
+        # Cut only the upper part of the face, above the nose
+        height = round(face_gray.shape[0] * config.get("eye_region_height", DEFAULT_EYE_REGION_HEIGHT))
+        upper_gray_image = face_gray[:height, :]
+
+        # Detects eyes only at the top of the face
+        min_size = int(face_gray.shape[1] * self.eye_min_size)
+        eyes = self._eye_cascade().detectMultiScale(upper_gray_image, minNeighbors=4, minSize=(min_size, min_size))
+
+        # Take the two biggest
+        eyes = sorted(eyes, key=lambda x: x[2] * x[3], reverse=True)[:2]
+
+        max_area = 0.0
+        for (ex, ey, ew, eh) in eyes:
+            eye_roi = upper_gray_image[ey:ey+eh, ex:ex+ew]
+            thresh = cv2.threshold(eye_roi, 70, 255, cv2.THRESH_BINARY_INV)[1]
+            cnts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+
+            for c in cnts:
+                max_area = max(max_area, cv2.contourArea(c))
+
+        if annotations is not None:
+            annotated = cv2.cvtColor(upper_gray_image, cv2.COLOR_GRAY2BGR)
+            for (ex, ey, ew, eh) in eyes:
+                cv2.rectangle(annotated, (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
+            annotations.add("height_eyes", upper_gray_image)
+            annotations.add("eyes", annotated)
+        return float(max_area / image.scale ** 2)
+
+    def _face_mesh_input(self, working: LoadedImage, faces: FaceContext, index: int = 0) -> Tuple[np.ndarray, Tuple[int, int]]:
+        '''
+        Pixels given to FaceMesh and their offset in working
+        '''
+        # FaceMesh runs on the face region only, with a margin so its own detector still finds the face
+        return faces.roi(working.rgb, index, margin=SMILE_ROI_MARGIN)
+
+    def _mouth_measures(self, image: LoadedImage, faces: FaceContext, annotations: Annotations = None,
+                        working: LoadedImage = None, scale: float = 1.0, index: int = 0) -> Tuple[Optional[float], Optional[float]]:
+        '''
+        Using Mediapipe to Face Classification
+        Mouth width in original image pixels and mouth width / height ratio, None when FaceMesh finds no face
+        working: Reduced copy of image FaceMesh runs on, scale: its size relative to image
+        '''
+        working = working if working is not None else image
+        face_rgb, (off_x, off_y) = self._face_mesh_input(working, faces.scaled(scale), index)
+        results = self.face_mesh.process(np.ascontiguousarray(face_rgb))
+
+        if not results.multi_face_landmarks:
+            if annotations is not None:
+                annotations.add("smile", image.bgr)
+            return None, None
+
+        landmarks = results.multi_face_landmarks[0].landmark
+        img_h, img_w, _ = face_rgb.shape
+
+        def to_pixel(landmark):
+            return np.array([landmark.x * img_w + off_x, landmark.y * img_h + off_y]) / scale
+
+        # Position of the mouth points
+
+        left_pt = to_pixel(landmarks[61])
+        right_pt = to_pixel(landmarks[291])
+        top_pt = to_pixel(landmarks[13])
+        bottom_pt = to_pixel(landmarks[14])
+
+        mouth_width = np.linalg.norm(right_pt - left_pt)
+        mouth_height = np.linalg.norm(top_pt - bottom_pt)
+        smile_ratio = mouth_width / (mouth_height + 1e-6)
+
+        # Draw
+        if annotations is not None:
+            annotated = image.bgr.copy()
+            cv2.putText(annotated, f"Smile Ratio: {smile_ratio:.2f}", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255), 6)
+            cv2.line(annotated, tuple(left_pt.astype(int)), tuple(right_pt.astype(int)), (0, 255, 255), 2)
+            cv2.line(annotated, tuple(top_pt.astype(int)), tuple(bottom_pt.astype(int)), (255, 0, 255), 2)
+            annotations.add("smile", annotated)
+        return float(mouth_width / image.scale), float(smile_ratio)
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_default_engine() -> FaceQAEngine:
+    '''
+    Shared engine of the process, created on first use with an in-memory result cache
+    '''
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = FaceQAEngine(cache=ResultCache())
+    return _default_engine
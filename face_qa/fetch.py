@@ -0,0 +1,114 @@
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Coroutine, List
+import asyncio
+import threading
+import aiohttp
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    '''
+    Raised when an image can't be downloaded
+    '''
+
+
+class ImageTooLargeError(FetchError):
+    '''
+    Raised when the response body is bigger than the configured maximum
+    '''
+
+
+class ImageFetcher():
+    '''
+    Asyncio image downloader with a pooled keep-alive client.
+
+    max_bytes: Maximum body size, bigger responses raise ImageTooLargeError
+    connect_timeout: Seconds to open the connection
+    read_timeout: Seconds allowed between two reads of the body
+    limit: Maximum number of open connections
+    limit_per_host: Maximum number of concurrent connections to the same host
+    '''
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, connect_timeout: float = 3.0, read_timeout: float = 10.0,
+                 limit: int = 100, limit_per_host: int = 8):
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session is bound to the running loop, so it is created on first use
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def fetch(self, url: str) -> bytearray:
+        '''
+        Download url and return the raw body, ready to be passed to FaceQA
+        '''
+        try:
+            async with self._get_session().get(url) as response:
+                if response.status != 200:
+                    raise FetchError(f"Failed to download image from URL: {url} (HTTP {response.status})")
+                if response.content_length is not None and response.content_length > self.max_bytes:
+                    raise ImageTooLargeError(f"Image is bigger than {self.max_bytes} bytes: {url}")
+
+                # Read in chunks so an oversized body is dropped without being buffered
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise ImageTooLargeError(f"Image is bigger than {self.max_bytes} bytes: {url}")
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError(f"Failed to download image from URL: {url} ({e or type(e).__name__})") from e
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+async def score_urls(fetcher: ImageFetcher, urls: List[str], submit, version: int) -> List[Any]:
+    '''
+    Download every url concurrently and score each image as soon as it arrives,
+    so the downloads overlap with the scoring running on the worker pool.
+
+    submit: Callable (image, version) -> concurrent.futures.Future, e.g. ScoringPool.submit
+    Returns one result per url, or the exception raised for that url.
+    '''
+    async def fetch_and_score(url):
+        image = await fetcher.fetch(url)
+        return await asyncio.wrap_future(submit(image, version))
+
+    return await asyncio.gather(*(fetch_and_score(url) for url in urls), return_exceptions=True)
+
+
+class BackgroundFetcher():
+    '''
+    Runs an ImageFetcher on its own event loop thread, for synchronous callers
+    such as the HTTP handlers. Accepts the same options as ImageFetcher.
+    '''
+    def __init__(self, **options):
+        self.fetcher = ImageFetcher(**options)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="face-qa-fetch", daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def fetch(self, url: str, timeout: float = None) -> bytearray:
+        future = self.submit(self.fetcher.fetch(url))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise FetchError(f"Timed out downloading image from URL: {url}")
+
+    def close(self):
+        self.submit(self.fetcher.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
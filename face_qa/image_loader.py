@@ -0,0 +1,191 @@
+from typing import Callable, Optional, Tuple, Union
+import struct
+import cv2
+import numpy as np
+import os
+
+ImageSource = Union[str, os.PathLike, bytes, bytearray, memoryview, np.ndarray]
+
+# OpenCV flags decoding a JPEG at 1/factor of its size through libjpeg DCT scaling, (color, grayscale)
+REDUCED_FLAGS = {
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+}
+
+# JPEG start of frame markers, they hold the image size
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class LoadedImage():
+    '''
+    Image decoded once and shared by every check.
+    bgr: Decoded BGR pixel buffer
+    gray: Decoded grayscale buffer, for images read in grayscale (bgr is None)
+    decode_color: Called the first time the colors of a grayscale image are needed
+    scale: Decoded pixels per original image pixel, below 1 when the file was decoded at a reduced size
+    The RGB and grayscale conversions are done on first access and cached.
+    '''
+    def __init__(self, bgr: np.ndarray = None, gray: np.ndarray = None, decode_color: Callable[[], np.ndarray] = None,
+                 scale: float = 1.0):
+        self._bgr = bgr
+        self._rgb = None
+        self._gray = gray
+        self._decode_color = decode_color
+        self.scale = scale
+        self._reduced = {}
+
+    @property
+    def bgr(self) -> np.ndarray:
+        if self._bgr is None:
+            self._bgr = self._decode_color() if self._decode_color is not None else cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR)
+            self._decode_color = None
+        return self._bgr
+
+    @property
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def shape(self):
+        '''
+        Shape of bgr, without decoding the colors of a grayscale image
+        '''
+        return self._bgr.shape if self._bgr is not None else self._gray.shape + (3,)
+
+    def reduced(self, long_edge: Optional[int]) -> Tuple['LoadedImage', float]:
+        '''
+        Working copy whose longest side is at most long_edge pixels, made once per size and cached.
+        Returns the copy and its scale (copy pixels per original pixel), or this image and 1.0
+        when it is already small enough or long_edge is None.
+        '''
+        height, width = self.shape[:2]
+        if not long_edge or max(height, width) <= long_edge:
+            return self, 1.0
+        if long_edge not in self._reduced:
+            scale = long_edge / max(height, width)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            # INTER_AREA averages the source pixels, so the brightness and contrast are preserved
+            if self._bgr is not None:
+                reduced = LoadedImage(cv2.resize(self._bgr, size, interpolation=cv2.INTER_AREA), scale=self.scale * size[0] / width)
+            else:
+                # A grayscale image stays grayscale, its colors are reduced the same way if they are ever needed
+                reduced = LoadedImage(gray=cv2.resize(self._gray, size, interpolation=cv2.INTER_AREA),
+                                      decode_color=lambda: cv2.resize(self.bgr, size, interpolation=cv2.INTER_AREA),
+                                      scale=self.scale * size[0] / width)
+            self._reduced[long_edge] = (reduced, size[0] / width)
+        return self._reduced[long_edge]
+
+
+def load_image(source: ImageSource, long_edge: int = None, grayscale: bool = False) -> LoadedImage:
+    '''
+    source: Image file path, encoded image bytes/memoryview or decoded BGR np.ndarray
+    long_edge: Smallest longest side wanted, a bigger JPEG is decoded at 1/2, 1/4 or 1/8 of its size
+    when that still leaves long_edge pixels (see LoadedImage.scale)
+    grayscale: Decode only the gray levels, the colors are decoded again on first use of bgr or rgb
+    '''
+    if isinstance(source, LoadedImage):
+        return source
+
+    if isinstance(source, np.ndarray):
+        return LoadedImage(_to_bgr(source))
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _decode(np.frombuffer(source, np.uint8), long_edge, grayscale, "Could not decode image bytes")
+
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            data = np.fromfile(os.fspath(source), np.uint8)
+        except OSError:
+            data = None
+        if data is None or not len(data):
+            raise ValueError(f"Could not read image: {source}")
+        return _decode(data, long_edge, grayscale, f"Could not read image: {source}")
+
+    raise TypeError(f"Unsupported image source: {type(source).__name__}")
+
+
+def jpeg_size(data: np.ndarray) -> Optional[Tuple[int, int]]:
+    '''
+    (width, height) read from the JPEG header, None when data is not a JPEG
+    '''
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    # Segments are followed across the whole buffer, the EXIF, XMP and ICC segments of
+    # phone photos can put the frame header well beyond the first 64 KB
+    header = memoryview(np.ascontiguousarray(data))
+    i = 2
+    while i + 9 < len(header):
+        if header[i] != 0xFF:
+            return None
+        marker = header[i + 1]
+        if marker == 0xFF:
+            i += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+        elif marker in SOF_MARKERS:
+            height, width = struct.unpack_from('>HH', header, i + 5)
+            return width, height
+        elif marker in (0xD9, 0xDA):
+            # End of image or start of the scan data, there is no frame header before it
+            return None
+        else:
+            i += 2 + struct.unpack_from('>H', header, i + 2)[0]
+    return None
+
+
+def reduction_factor(size: Tuple[int, int], long_edge: Optional[int]) -> int:
+    '''
+    Biggest JPEG reduction (1, 2, 4 or 8) keeping at least long_edge pixels on the longest side
+    '''
+    if not long_edge:
+        return 1
+    return next((factor for factor in (8, 4, 2) if max(size) / factor >= long_edge), 1)
+
+
+def _decode(data: np.ndarray, long_edge: Optional[int], grayscale: bool, error: str) -> LoadedImage:
+    size = jpeg_size(data) if long_edge or grayscale else None
+    # Reduced and grayscale decoding only pay off with libjpeg, other formats are always decoded in full
+    if size is None:
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(error)
+        return LoadedImage(image)
+
+    factor = reduction_factor(size, long_edge)
+    color_flag, gray_flag = REDUCED_FLAGS.get(factor, (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE))
+    image = cv2.imdecode(data, gray_flag if grayscale else color_flag)
+    if image is None:
+        raise ValueError(error)
+    scale = max(image.shape[:2]) / max(size)
+    if not grayscale:
+        return LoadedImage(image, scale=scale)
+
+    def decode_color():
+        bgr = cv2.imdecode(data, color_flag)
+        if bgr is None:
+            raise ValueError(error)
+        return bgr
+    return LoadedImage(gray=image, decode_color=decode_color, scale=scale)
+
+
+def _to_bgr(array: np.ndarray) -> np.ndarray:
+    '''
+    Accept grayscale and BGRA arrays as well as BGR
+    '''
+    if array.dtype != np.uint8:
+        raise ValueError(f"Expected an uint8 image, got {array.dtype}")
+    if array.ndim == 2:
+        return cv2.cvtColor(array, cv2.COLOR_GRAY2BGR)
+    if array.ndim == 3 and array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_BGRA2BGR)
+    if array.ndim == 3 and array.shape[2] == 3:
+        return array
+    raise ValueError(f"Unsupported image shape: {array.shape}")
@@ -0,0 +1,148 @@
+'''
+Raw measurements taken by the checks and their evaluation against the thresholds.
+
+check() returns the measurements in result["metrics"]. evaluate() turns them
+into the boolean result and is cheap enough to run again on stored metrics
+whenever a threshold changes. Only the keys in MEASUREMENT_KEYS change the
+measurements themselves and need the checks to run again.
+
+In fail-fast mode ("fail_fast": true in config) the stages run cheapest first and
+stop at the first failing check, the checks left out are None in the result and
+listed in metrics["skipped"].
+'''
+
+# Settings used while measuring, the other config keys are thresholds
+MEASUREMENT_KEYS = (
+    "scale_factor_face_cascade",
+    "min_neighbors_face_cascade",
+    "min_size_face_cascade",
+    "eye_region_height",
+    "analysis_long_edge",
+    "fast_decode",
+    "fail_fast",
+    "check_order",
+    "detector",
+    "detector_model",
+    "detector_score_threshold",
+)
+
+# Smiles are only evaluated above this mouth width / height ratio
+MIN_SMILE_RATIO = 1.1
+
+# Boolean checks decided by each measurement stage
+STAGE_CHECKS = {
+    "detection": ("face_detected", "more_than_one_face"),
+    "eyes": ("eyes_is_good",),
+    "smile": ("is_smiling",),
+    "contrast": ("contrast_is_good",),
+    "brightness": ("brightness_is_good",),
+    "centering": ("face_is_centralized",),
+}
+
+# Value of each check for an image that passes
+PASSING = {
+    "face_detected": True,
+    "more_than_one_face": False,
+    "eyes_is_good": True,
+    "is_smiling": False,
+    "contrast_is_good": True,
+    "brightness_is_good": True,
+    "face_is_centralized": True,
+}
+
+
+def empty_metrics(face_count: int = 0) -> dict:
+    return {
+        "face_count": face_count,
+        "brightness": None,
+        "contrast": None,
+        "face_center_offset": None,
+        "eye_contour_area": None,
+        "mouth_width": None,
+        "smile_ratio": None,
+        # Checks not run because fail-fast mode already had a failing check
+        "skipped": [],
+    }
+
+
+def measurement_config(config: dict) -> dict:
+    '''
+    Part of config that changes the measurements.
+    In fail-fast mode the thresholds decide which checks run, so all of config is returned.
+    '''
+    if config.get("fail_fast"):
+        return dict(config)
+    return {key: config[key] for key in MEASUREMENT_KEYS if key in config}
+
+
+def evaluate(metrics: dict, config: dict) -> dict:
+    '''
+    metrics: Raw measurements of one image (result["metrics"])
+    config: Thresholds to compare them with
+    Checks listed in metrics["skipped"] are None
+    '''
+    if metrics["face_count"] == 0:
+        return {
+          "face_detected": False,
+          "more_than_one_face": False,
+          "eyes_is_good": False,
+          "is_smiling": False,
+          "contrast_is_good": False,
+          "brightness_is_good": False,
+          "face_is_centralized": False
+        }
+
+    skipped = metrics.get("skipped", ())
+    return {name: None if name in skipped else check(metrics, config) for name, check in CHECKS.items()}
+
+
+# Checks that apply to each face of a multi-face result
+FACE_CHECKS = ("eyes_is_good", "is_smiling", "contrast_is_good", "brightness_is_good", "face_is_centralized")
+
+
+def empty_face_metrics() -> dict:
+    return {
+        "brightness": None,
+        "contrast": None,
+        "face_center_offset": None,
+        "eye_contour_area": None,
+        "mouth_width": None,
+        "smile_ratio": None,
+    }
+
+
+def evaluate_face(metrics: dict, config: dict) -> dict:
+    '''
+    Checks of one face of a multi-face result, brightness and contrast are those of the face region
+    '''
+    return {name: CHECKS[name](metrics, config) for name in FACE_CHECKS}
+
+
+def failed_checks(metrics: dict, config: dict, names) -> list:
+    '''
+    Checks among names whose value differs from PASSING
+    '''
+    return [name for name in names if CHECKS[name](metrics, config) != PASSING[name]]
+
+
+def _is_smiling(metrics: dict, config: dict) -> bool:
+    smile_ratio = metrics["smile_ratio"]
+    if smile_ratio is None:
+        return False
+    # Extra validations
+    if metrics["mouth_width"] < config.get("min_mouth_width", 40):
+        return False
+    if smile_ratio < MIN_SMILE_RATIO:
+        return False
+    return smile_ratio < config.get("smile_ratio_threshold", 1.8)
+
+
+CHECKS = {
+    "face_detected": lambda metrics, config: metrics["face_count"] > 0,
+    "more_than_one_face": lambda metrics, config: metrics["face_count"] > 1,
+    "eyes_is_good": lambda metrics, config: metrics["eye_contour_area"] > config["eye_area_threshold"],
+    "is_smiling": _is_smiling,
+    "contrast_is_good": lambda metrics, config: metrics["contrast"] >= config["contrast_threshold"],
+    "brightness_is_good": lambda metrics, config: metrics["brightness"] >= config["brightness_threshold"],
+    "face_is_centralized": lambda metrics, config: metrics["face_center_offset"] <= config["face_center_threshold"],
+}
@@ -0,0 +1,255 @@
+'''
+Production monitoring of the checks.
+
+StageHook is the instrumentation surface: hooks added to a FaceQAEngine with
+add_hook() are called around every stage of check() (decode, detection, eyes,
+smile, contrast, brightness, centering, annotation) with its duration and error,
+and once per check with the result. An engine without hooks only pays for an
+empty loop per stage.
+
+MetricsAggregator is the built-in hook. It keeps in-process histograms of the
+stage and check durations and counters of the check outcomes and errors, and
+renders them in the Prometheus text format (the /metrics endpoint of the HTTP
+service). Results computed in other processes are added with record().
+
+SamplingProfiler samples the stacks of every thread of the process while it is
+enabled and gives them in the collapsed format read by flamegraph.pl and speedscope.
+'''
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import bisect
+import collections
+import os
+import sys
+import threading
+from face_qa.metrics import PASSING
+
+# Upper bounds in seconds of the duration histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageHook():
+    '''
+    Callbacks of FaceQAEngine.check(), subclasses override the ones they need.
+    They run on the thread doing the check and must be thread safe when the engine is shared.
+    '''
+    def stage_started(self, stage: str):
+        pass
+
+    def stage_finished(self, stage: str, seconds: float, error: Optional[BaseException]):
+        '''
+        error: Exception raised by the stage, None when it succeeded
+        '''
+
+    def check_finished(self, version: int, result, seconds: float, error: Optional[BaseException]):
+        '''
+        result: QAResult of the check, None when it raised error
+        '''
+
+
+class Histogram():
+    '''
+    Count of the observed values below each bucket bound, with their sum
+    '''
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        '''
+        (le, count) of every bucket, the last one is +Inf
+        '''
+        total, lines = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            lines.append(("+Inf" if bound == float("inf") else repr(float(bound)), total))
+        return lines
+
+
+def _labels(**labels) -> str:
+    values = {key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in labels.items()}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in values.items()) + "}"
+
+
+class MetricsAggregator(StageHook):
+    '''
+    In-process histograms and counters of the checks, see render() for the exported series.
+    buckets: Upper bounds in seconds of the duration histograms
+    '''
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._checks: Dict[int, Histogram] = {}
+        self._outcomes = collections.Counter()
+        self._errors = collections.Counter()
+
+    def stage_finished(self, stage: str, seconds: float, error: Optional[BaseException]):
+        with self._lock:
+            self._observe_stage(stage, seconds)
+            if error is not None:
+                self._errors[(stage, type(error).__name__)] += 1
+
+    def check_finished(self, version: int, result, seconds: float, error: Optional[BaseException]):
+        with self._lock:
+            self._observe_check(version, result, seconds, error, "check")
+
+    def record(self, version: int, result, seconds: float = None):
+        '''
+        Add a check run elsewhere (another process): its stage timings and outcomes
+        result: QAResult, or the exception raised by the check
+        seconds: Duration of the whole check, result.timings are summed if None
+        '''
+        error = result if isinstance(result, Exception) else None
+        result = None if error is not None else result
+        with self._lock:
+            if result is not None:
+                for stage, stage_seconds in result.timings.items():
+                    self._observe_stage(stage, stage_seconds)
+                seconds = seconds if seconds is not None else sum(result.timings.values())
+            self._observe_check(version, result, seconds, error, "worker")
+
+    def _observe_stage(self, stage: str, seconds: float):
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def _observe_check(self, version: int, result, seconds: Optional[float], error: Optional[BaseException], where: str):
+        if seconds is not None:
+            histogram = self._checks.get(version)
+            if histogram is None:
+                histogram = self._checks[version] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        if error is not None:
+            self._errors[(where, type(error).__name__)] += 1
+            return
+        for name, passing in PASSING.items():
+            value = getattr(result, name)
+            outcome = "skipped" if value is None else "pass" if value == passing else "fail"
+            self._outcomes[(name, outcome)] += 1
+
+    def render(self) -> str:
+        '''
+        Prometheus text exposition of:
+        face_qa_stage_seconds{stage}: histogram of the duration of each stage
+        face_qa_check_seconds{version}: histogram of the duration of whole checks
+        face_qa_check_outcomes_total{check, outcome}: checks that passed, failed or were skipped
+        face_qa_errors_total{stage, error}: exceptions raised, stage "check" (or "worker" for record())
+        counts every failed check and the other stages the one that raised
+        '''
+        with self._lock:
+            lines = []
+            _render_histograms(lines, "face_qa_stage_seconds", "Duration of each stage of a check",
+                               (({"stage": stage}, histogram) for stage, histogram in sorted(self._stages.items())))
+            _render_histograms(lines, "face_qa_check_seconds", "Duration of a whole check",
+                               (({"version": version}, histogram) for version, histogram in sorted(self._checks.items())))
+            _render_counter(lines, "face_qa_check_outcomes_total", "Outcome of each check",
+                            (({"check": check, "outcome": outcome}, count)
+                             for (check, outcome), count in sorted(self._outcomes.items())))
+            _render_counter(lines, "face_qa_errors_total", "Exceptions raised while checking an image",
+                            (({"stage": stage, "error": error}, count) for (stage, error), count in sorted(self._errors.items())))
+        return "\n".join(lines) + "\n"
+
+
+def _render_histograms(lines: List[str], name: str, help_text: str, series: Iterable[Tuple[dict, Histogram]]):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in series:
+        for le, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels(**labels, le=le)} {count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum!r}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+def _render_counter(lines: List[str], name: str, help_text: str, series: Iterable[Tuple[dict, int]]):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines += [f"{name}{_labels(**labels)} {value}" for labels, value in series]
+
+
+def render_gauges(gauges: Dict[str, Tuple[str, float]]) -> str:
+    '''
+    Prometheus text of gauges given as {name: (help, value)}
+    '''
+    lines = []
+    for name, (help_text, value) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler():
+    '''
+    Statistical profiler of the whole process: a daemon thread records the stack of
+    every other thread each interval seconds while enabled. Nothing runs when disabled.
+    interval: Seconds between two samples
+    '''
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = None):
+        if interval is not None:
+            self.interval = interval
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="face-qa-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id != own:
+                        self._stacks[_stack(frame)] += 1
+
+    def collapsed(self) -> str:
+        '''
+        One "outer;...;inner count" line per sampled stack, the most frequent first
+        '''
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
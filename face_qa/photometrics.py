@@ -0,0 +1,116 @@
+'''
+Photometric metrics of many images at once, the cheap first stage of bulk audits.
+
+photometric_metrics() takes a stack of same-sized images (N, H, W) or (N, H, W, 3),
+or a list of images of any size, and returns one array per metric:
+- brightness: mean gray level (same as the brightness check)
+- contrast: standard deviation of the gray levels (same as the contrast check)
+- dark_clipped / bright_clipped: fraction of pixels at or beyond the clipping levels
+- sharpness: variance of the Laplacian, low values mean a blurry image
+
+Each chunk of the stack is converted to gray with one cvtColor call and reduced along
+the pixel axis with integer sums, so there is no Python loop over the images and no
+float copy of the pixels.
+'''
+from typing import Dict, List, Sequence, Tuple, Union
+import cv2
+import numpy as np
+
+METRICS = ("brightness", "contrast", "dark_clipped", "bright_clipped", "sharpness")
+
+# Pixels processed per vectorized call, bounds the temporary buffers
+CHUNK_PIXELS = 1 << 24
+
+ImageStack = Union[np.ndarray, Sequence[np.ndarray]]
+
+
+def photometric_metrics(images: ImageStack, clip_low: int = 5, clip_high: int = 250,
+                        chunk_pixels: int = CHUNK_PIXELS) -> Dict[str, np.ndarray]:
+    '''
+    images: uint8 stack (N, H, W) gray or (N, H, W, 3) BGR, or a list of such images of any size
+    clip_low, clip_high: Gray levels counted as clipped shadows and highlights
+    Returns a dict of float64 arrays of length N, in the order of images
+    '''
+    if isinstance(images, np.ndarray):
+        return _stack_metrics(images, clip_low, clip_high, chunk_pixels)
+
+    # Images of the same shape are stacked and measured together
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for index, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(index)
+
+    result = {name: np.empty(len(images)) for name in METRICS}
+    for indexes in groups.values():
+        stack = np.stack([images[i] for i in indexes])
+        for name, values in _stack_metrics(stack, clip_low, clip_high, chunk_pixels).items():
+            result[name][indexes] = values
+    return result
+
+
+def face_rois(images: Sequence[np.ndarray], boxes: Sequence[Tuple[int, int, int, int]],
+              size: Tuple[int, int] = (128, 128)) -> np.ndarray:
+    '''
+    Stack of the face regions, each resized to size (width, height),
+    written straight into one preallocated array ready for photometric_metrics()
+    boxes: (x, y, w, h) of the face of each image
+    '''
+    width, height = size
+    channels = images[0].shape[2:] if len(images) else ()
+    stack = np.empty((len(images), height, width) + channels, np.uint8)
+    for i, (image, (x, y, w, h)) in enumerate(zip(images, boxes)):
+        cv2.resize(image[max(y, 0):y + h, max(x, 0):x + w], size, dst=stack[i], interpolation=cv2.INTER_AREA)
+    return stack
+
+
+def _stack_metrics(stack: np.ndarray, clip_low: int, clip_high: int, chunk_pixels: int) -> Dict[str, np.ndarray]:
+    if stack.dtype != np.uint8:
+        raise ValueError(f"Expected uint8 images, got {stack.dtype}")
+    if stack.ndim not in (3, 4) or (stack.ndim == 4 and stack.shape[3] != 3):
+        raise ValueError(f"Expected a (N, H, W) or (N, H, W, 3) stack, got {stack.shape}")
+
+    count, height, width = stack.shape[:3]
+    result = {name: np.empty(count) for name in METRICS}
+    step = max(1, chunk_pixels // max(1, height * width))
+    for start in range(0, count, step):
+        gray = _gray_stack(stack[start:start + step])
+        chunk = slice(start, start + len(gray))
+        _moment_metrics(gray, clip_low, clip_high, result, chunk)
+        result["sharpness"][chunk] = _laplacian_variance(gray)
+    return result
+
+
+def _gray_stack(stack: np.ndarray) -> np.ndarray:
+    if stack.ndim == 3:
+        return stack
+    count, height, width = stack.shape[:3]
+    # The chunk is seen as one tall image, so a single cvtColor converts all of it
+    tall = np.ascontiguousarray(stack).reshape(count * height, width, 3)
+    return cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY).reshape(count, height, width)
+
+
+def _moment_metrics(gray: np.ndarray, clip_low: int, clip_high: int, result: Dict[str, np.ndarray], chunk: slice):
+    count = len(gray)
+    flat = gray.reshape(count, -1)
+    pixels = flat.shape[1]
+    # Integer sums are exact and need no float copy of the pixels
+    total = flat.sum(axis=1, dtype=np.uint64).astype(np.float64)
+    squares = np.einsum('ij,ij->i', flat, flat, dtype=np.int64).astype(np.float64)
+    mean = total / pixels
+    result["brightness"][chunk] = mean
+    result["contrast"][chunk] = np.sqrt(np.maximum(squares / pixels - mean * mean, 0.0))
+    result["dark_clipped"][chunk] = np.count_nonzero(flat <= clip_low, axis=1) / pixels
+    result["bright_clipped"][chunk] = np.count_nonzero(flat >= clip_high, axis=1) / pixels
+
+
+def _laplacian_variance(gray: np.ndarray) -> np.ndarray:
+    count, height, width = gray.shape
+    # One Laplacian over the tall image, the first and last row of each image
+    # mix pixels of two images and are left out of the variance
+    laplacian = cv2.Laplacian(np.ascontiguousarray(gray).reshape(count * height, width), cv2.CV_16S)
+    laplacian = laplacian.reshape(count, height, width)
+    if height > 2:
+        laplacian = laplacian[:, 1:-1]
+    pixels = laplacian.shape[1] * laplacian.shape[2]
+    total = laplacian.sum(axis=(1, 2), dtype=np.float64)
+    squares = np.einsum('nij,nij->n', laplacian, laplacian, dtype=np.float64)
+    return squares / pixels - (total / pixels) ** 2
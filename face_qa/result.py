@@ -0,0 +1,167 @@
+'''
+Result of one check() call.
+
+QAResult holds the boolean checks as native bools (None for checks skipped by
+fail-fast mode), the raw metrics and the stage timings. It still reads like the
+dict returned before, result["face_detected"] and dict(result) work, and to_dict()
+/ to_json() give plain JSON-ready values without walking the result.
+
+to_records() turns many results into one numpy structured array, one row per
+image and one column per check, metric and stage, for bulk runs (np.save, pandas).
+'''
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+import json
+import numpy as np
+from face_qa.stages import STAGES
+
+CHECK_FIELDS = (
+    "face_detected",
+    "more_than_one_face",
+    "eyes_is_good",
+    "is_smiling",
+    "contrast_is_good",
+    "brightness_is_good",
+    "face_is_centralized",
+)
+
+# Numeric metrics exported by to_records(), face_count is -1 when detection was skipped
+METRIC_COLUMNS = (
+    ("face_count", np.int32),
+    ("brightness", np.float64),
+    ("contrast", np.float64),
+    ("face_center_offset", np.float64),
+    ("eye_contour_area", np.float64),
+    ("mouth_width", np.float64),
+    ("smile_ratio", np.float64),
+)
+
+_KEYS = CHECK_FIELDS + ("metrics", "timings")
+
+
+@dataclass
+class QAResult():
+    __slots__ = CHECK_FIELDS + ("metrics", "timings", "annotations")
+
+    face_detected: Optional[bool]
+    more_than_one_face: Optional[bool]
+    eyes_is_good: Optional[bool]
+    is_smiling: Optional[bool]
+    contrast_is_good: Optional[bool]
+    brightness_is_good: Optional[bool]
+    face_is_centralized: Optional[bool]
+    metrics: dict
+    timings: dict
+    annotations: Optional[dict]
+
+    @classmethod
+    def from_checks(cls, checks: dict, metrics: dict, timings: dict, annotations: dict = None) -> 'QAResult':
+        '''
+        checks: Output of metrics.evaluate()
+        '''
+        return cls(*(checks[name] for name in CHECK_FIELDS), metrics, timings, annotations)
+
+    def __reduce__(self):
+        # Pickled as a plain tuple of the fields, results come back from the worker processes this way
+        return (QAResult, tuple(getattr(self, name) for name in self.__slots__))
+
+    def checks(self) -> dict:
+        return {name: getattr(self, name) for name in CHECK_FIELDS}
+
+    def to_dict(self) -> dict:
+        result = self.checks()
+        result["metrics"] = dict(self.metrics)
+        result["timings"] = dict(self.timings)
+        if self.annotations is not None:
+            result["annotations"] = self.annotations
+        return result
+
+    def to_json(self) -> str:
+        '''
+        JSON of the checks, metrics and timings (annotated images are left out)
+        '''
+        result = self.checks()
+        result["metrics"] = self.metrics
+        result["timings"] = self.timings
+        return json.dumps(result)
+
+    # Read access of the former dict result
+    def keys(self) -> List[str]:
+        keys = list(_KEYS)
+        if self.annotations is not None:
+            keys.append("annotations")
+        return keys
+
+    def __getitem__(self, key: str):
+        if key in self:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in _KEYS or (key == "annotations" and self.annotations is not None)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self else default
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+
+@dataclass
+class FaceResult():
+    '''
+    One face of a multi-face check (FaceQAEngine.check_faces)
+    box: (x, y, w, h) in image pixels
+    confidence: Detector score, None for the Haar cascade
+    '''
+    __slots__ = ("box", "confidence", "eyes_is_good", "is_smiling", "contrast_is_good", "brightness_is_good",
+                 "face_is_centralized", "metrics")
+
+    box: Tuple[int, int, int, int]
+    confidence: Optional[float]
+    eyes_is_good: bool
+    is_smiling: bool
+    contrast_is_good: bool
+    brightness_is_good: bool
+    face_is_centralized: bool
+    metrics: dict
+
+    def to_dict(self) -> dict:
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result["box"] = list(self.box)
+        result["metrics"] = dict(self.metrics)
+        return result
+
+
+def records_dtype(input_width: int = 0) -> np.dtype:
+    '''
+    input_width: Characters of the "input" column, no such column if 0
+    '''
+    fields = [("input", f"U{input_width}")] if input_width else []
+    # Checks are 1 (true), 0 (false) or -1 (skipped)
+    fields += [(name, np.int8) for name in CHECK_FIELDS]
+    fields += list(METRIC_COLUMNS)
+    fields += [(f"{stage}_s", np.float64) for stage in STAGES]
+    return np.dtype(fields)
+
+
+def to_records(results: Iterable[QAResult], names: Sequence[str] = None) -> np.ndarray:
+    '''
+    One row per result in a numpy structured array.
+    Missing metrics and stages that did not run are NaN.
+    names: Optional input name of each result, stored in the "input" column
+    '''
+    results = list(results)
+    input_width = max((len(str(name)) for name in names), default=1) if names is not None else 0
+    records = np.zeros(len(results), dtype=records_dtype(input_width))
+    if names is not None:
+        records["input"] = [str(name) for name in names]
+
+    for name in CHECK_FIELDS:
+        records[name] = [-1 if value is None else value for value in (getattr(r, name) for r in results)]
+    for name, dtype in METRIC_COLUMNS:
+        missing = -1 if name == "face_count" else np.nan
+        records[name] = [missing if value is None else value for value in (r.metrics[name] for r in results)]
+    for stage in STAGES:
+        records[f"{stage}_s"] = [r.timings.get(stage, np.nan) for r in results]
+    return records
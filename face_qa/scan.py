@@ -0,0 +1,205 @@
+'''
+Scoring of huge image directories with constant memory.
+
+scan_images() walks the tree with os.scandir and yields the image paths as it
+goes, every directory listed in name order so a run always visits the images
+in the same order. scan_directory() feeds them to check_many and writes each
+result as soon as it is ready to a JSONL or CSV file.
+
+Progress is saved to a checkpoint file next to the output: the last path
+written and the size of the output at that point. An interrupted run started
+again with the same output resumes after that path, skipping whole directories
+that were already done, instead of starting from the first image.
+'''
+from typing import IO, Iterator, Sequence, Tuple
+import csv
+import fnmatch
+import json
+import sys
+import time
+import os
+from face_qa.batch import IMAGE_EXTENSIONS, check_many
+from face_qa.result import CHECK_FIELDS, METRIC_COLUMNS
+
+DEFAULT_PATTERNS = tuple(f"*{extension}" for extension in IMAGE_EXTENSIONS)
+
+
+def scan_images(root: str, include: Sequence[str] = DEFAULT_PATTERNS, exclude: Sequence[str] = (),
+                after: str = None) -> Iterator[str]:
+    '''
+    Image paths under root, recursively, without listing the whole tree up front.
+    include: Glob patterns a file name must match (case insensitive)
+    exclude: Glob patterns of file or directory names, or paths relative to root, left out
+    after: Only yield the paths that come after this one in the scan order (resume)
+    '''
+    include = [pattern.lower() for pattern in include]
+    resume = tuple(os.path.relpath(after, root).split(os.sep)) if after else None
+    yield from _scan(root, (), include, list(exclude), resume)
+
+
+def _scan(folder_path: str, parts: Tuple[str, ...], include, exclude, resume) -> Iterator[str]:
+    # Only the names of one directory are held, sorted so the order is the same on every run
+    with os.scandir(folder_path) as entries:
+        names = sorted((entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries)
+
+    for name, is_dir in names:
+        key = parts + (name,)
+        relative = '/'.join(key)
+        if any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern) for pattern in exclude):
+            continue
+        path = os.path.join(folder_path, name)
+        if is_dir:
+            # Directories entirely before the resume point are skipped without being listed
+            if resume is not None and key < resume[:len(key)]:
+                continue
+            inner = resume if resume is not None and key == resume[:len(key)] else None
+            yield from _scan(path, key, include, exclude, inner)
+        elif any(fnmatch.fnmatch(name.lower(), pattern) for pattern in include):
+            if resume is not None and key <= resume:
+                continue
+            yield path
+
+
+class Checkpoint():
+    '''
+    Progress of a scan_directory() run, saved atomically as JSON.
+    last: Last input written, count: Results written, offset: Output size in bytes after the last result
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.last = None
+        self.count = 0
+        self.offset = 0
+
+    def load(self) -> bool:
+        if not os.path.isfile(self.path):
+            return False
+        with open(self.path, 'r') as checkpoint_file:
+            data = json.load(checkpoint_file)
+        self.last, self.count, self.offset = data["last"], data["count"], data["offset"]
+        return True
+
+    def save(self, last: str, count: int, offset: int):
+        self.last, self.count, self.offset = last, count, offset
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump({"last": last, "count": count, "offset": offset}, checkpoint_file)
+        os.replace(temporary, self.path)
+
+
+class JsonlWriter():
+    def __init__(self, output: IO[str]):
+        self.output = output
+
+    def write(self, source: str, result):
+        if isinstance(result, Exception):
+            line = {"input": source, "error": str(result)}
+        else:
+            line = {"input": source, "result": result.to_dict()}
+        self.output.write(json.dumps(line) + "\n")
+
+
+class CsvWriter():
+    '''
+    One row per image: input, error, the checks (empty when skipped) and the numeric metrics
+    '''
+    FIELDS = ("input", "error") + CHECK_FIELDS + tuple(name for name, _ in METRIC_COLUMNS)
+
+    def __init__(self, output: IO[str], header: bool = True):
+        self.writer = csv.writer(output)
+        if header:
+            self.writer.writerow(self.FIELDS)
+
+    def write(self, source: str, result):
+        if isinstance(result, Exception):
+            self.writer.writerow([source, str(result)] + [""] * (len(self.FIELDS) - 2))
+            return
+        row = [source, ""]
+        row += ["" if getattr(result, name) is None else getattr(result, name) for name in CHECK_FIELDS]
+        row += ["" if result.metrics[name] is None else result.metrics[name] for name, _ in METRIC_COLUMNS]
+        self.writer.writerow(row)
+
+
+class Progress():
+    '''
+    Images done, throughput and errors, redrawn on stream at most every interval seconds
+    '''
+    def __init__(self, stream: IO[str] = sys.stderr, interval: float = 1.0, start_count: int = 0):
+        self.stream = stream
+        self.interval = interval
+        self.count = start_count
+        self.errors = 0
+        self._done = 0
+        self._start = time.monotonic()
+        self._shown = 0.0
+
+    def update(self, result):
+        self.count += 1
+        self._done += 1
+        if isinstance(result, Exception):
+            self.errors += 1
+        now = time.monotonic()
+        if now - self._shown >= self.interval:
+            self._shown = now
+            self._draw(now)
+
+    def _draw(self, now: float, end: str = ""):
+        rate = self._done / max(now - self._start, 1e-9)
+        self.stream.write(f"\r{self.count} images, {rate:.1f} images/s, {self.errors} errors{end}")
+        self.stream.flush()
+
+    def close(self):
+        self._draw(time.monotonic(), "\n")
+
+
+def scan_directory(root: str, output_path: str, version: int = 1, output_format: str = None,
+                   include: Sequence[str] = DEFAULT_PATTERNS, exclude: Sequence[str] = (),
+                   workers: int = None, profile: str = None, checkpoint_path: str = None,
+                   checkpoint_every: int = 1000, progress: bool = True, restart: bool = False) -> int:
+    '''
+    Score every image under root and write one result per line to output_path.
+
+    output_format: "jsonl" or "csv", taken from the output extension if None
+    checkpoint_path: Progress file (output_path + ".checkpoint" if None), a run resumes from it unless restart
+    checkpoint_every: Results written between two checkpoints
+    Returns the number of results in the output
+    '''
+    output_format = output_format or ("csv" if output_path.lower().endswith(".csv") else "jsonl")
+    if output_format not in ("jsonl", "csv"):
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    checkpoint = Checkpoint(checkpoint_path or output_path + ".checkpoint")
+    resumed = not restart and checkpoint.load() and os.path.isfile(output_path)
+    if not resumed:
+        checkpoint = Checkpoint(checkpoint.path)
+
+    # Lines written after the last checkpoint are dropped, those images are scored again
+    mode = 'r+' if resumed else 'w'
+    with open(output_path, mode, newline='', encoding='utf-8') as output:
+        output.truncate(checkpoint.offset)
+        output.seek(checkpoint.offset)
+        if output_format == "csv":
+            writer = CsvWriter(output, header=checkpoint.offset == 0)
+        else:
+            writer = JsonlWriter(output)
+
+        display = Progress(start_count=checkpoint.count) if progress else None
+        count, last = checkpoint.count, checkpoint.last
+        sources = scan_images(root, include, exclude, after=checkpoint.last)
+        try:
+            # Ordered, so every line before the checkpoint belongs to an image before its path
+            for source, result in check_many(sources, version=version, workers=workers, ordered=True, profile=profile):
+                writer.write(source, result)
+                count, last = count + 1, source
+                if display is not None:
+                    display.update(result)
+                if count % checkpoint_every == 0:
+                    output.flush()
+                    checkpoint.save(last, count, output.tell())
+        finally:
+            output.flush()
+            if last is not None:
+                checkpoint.save(last, count, output.tell())
+            if display is not None:
+                display.close()
+    return count
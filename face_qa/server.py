@@ -0,0 +1,365 @@
+from concurrent.futures import Future, TimeoutError
+from typing import Any, List
+import base64
+import functools
+import binascii
+import logging
+import threading
+import time
+import os
+from flask import Flask, Response, request, jsonify
+from werkzeug.exceptions import BadRequest
+from face_qa.batch import _create_executor, _preload_worker, submit_check
+from face_qa.cache import ResultCache
+from face_qa.config import ConfigError, get_config_store
+from face_qa.fetch import DEFAULT_MAX_BYTES, BackgroundFetcher, FetchError, ImageTooLargeError, score_urls
+from face_qa.monitoring import MetricsAggregator, SamplingProfiler, render_gauges
+from face_qa.result import QAResult
+from face_qa.shm import SlabPool
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    '''
+    Raised when the scoring pool has no room for more images
+    '''
+
+
+class ScoringPool():
+    '''
+    Pool of workers with preloaded engines and a bounded number of images in flight.
+
+    workers: Number of workers (os.cpu_count() if None)
+    max_queue: Maximum number of images queued or running, new requests get QueueFullError beyond it
+    mode: "process" or "thread"
+    cache: ResultCache looked up before queueing an image, cached images never reach the workers
+    metrics: MetricsAggregator receiving the stage timings and outcomes of every image scored by the workers
+    shared_memory_slab: In process mode, images up to this many bytes reach the workers through
+    reused shared memory slabs instead of being pickled (see face_qa.shm), off if 0
+    '''
+    def __init__(self, workers: int = None, max_queue: int = 64, mode: str = "process", config_path: str = '/config.json',
+                 cache: ResultCache = None, metrics: MetricsAggregator = None, shared_memory_slab: int = 0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache = cache
+        self.metrics = metrics
+        self.config_store = get_config_store(config_path)
+        self.executor = _create_executor(self.workers, mode, config_path)
+        # One slab per image allowed in flight, so a queued image always finds one
+        self.slabs = SlabPool(shared_memory_slab, max_queue) if shared_memory_slab and mode == "process" else None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit_many(self, images: List[Any], version: int, profile: str = None) -> List[Future]:
+        '''
+        Queue every image that is not cached, or none of them
+        profile: Named profile of the configuration file, ConfigError if unknown
+        '''
+        # The workers reload the same file, results are cached under the configuration they will use
+        config = self.config_store.get(profile)
+        futures = [None] * len(images)
+        misses = []
+        for index, image in enumerate(images):
+            key = None
+            if self.cache is not None:
+                start = time.perf_counter()
+                key = self.cache.key(image, version, config)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    # Only the lookup ran, the stage timings of the check that was cached are not reported again
+                    cached["timings"] = {"cache": time.perf_counter() - start}
+                    futures[index] = Future()
+                    futures[index].set_result(cached)
+                    continue
+            misses.append((index, image, key))
+
+        with self._lock:
+            if self._in_flight + len(misses) > self.max_queue:
+                raise QueueFullError(f"Scoring queue is full ({self.max_queue} images)")
+            self._in_flight += len(misses)
+
+        for index, image, key in misses:
+            future = submit_check(self.executor, image, version, profile, self.slabs)
+            future.add_done_callback(self._release)
+            if self.metrics is not None:
+                # Results come back from the worker processes with their stage timings
+                future.add_done_callback(functools.partial(self._record, version))
+            if key is not None:
+                future.add_done_callback(functools.partial(self._store, key))
+            futures[index] = future
+        return futures
+
+    def submit(self, image: Any, version: int, profile: str = None) -> Future:
+        return self.submit_many([image], version, profile)[0]
+
+    def _release(self, _):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _record(self, version: int, future: Future):
+        if not future.cancelled() and future.exception() is None:
+            self.metrics.record(version, future.result())
+
+    def _store(self, key: str, future: Future):
+        result = future.result()
+        if isinstance(result, QAResult):
+            result = result.to_dict()
+            del result["timings"]
+            self.cache.put(key, result)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def preload(self):
+        '''
+        Start every worker and load its models before the first request
+        '''
+        for future in [self.executor.submit(_preload_worker) for _ in range(self.workers)]:
+            future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.slabs is not None:
+            self.slabs.close()
+
+
+def decode_base64_image(base64_str: str) -> bytes:
+    '''
+    Bytes of a base64 image, with or without a data URL prefix. ValueError for anything else
+    '''
+    if not isinstance(base64_str, str):
+        raise ValueError("Base64 image must be a string")
+    if ',' in base64_str:
+        base64_str = base64_str.split(',')[1]
+    return base64.b64decode(base64_str, validate=True)
+
+
+def _error(message: str, status: int):
+    return jsonify({"error": message}), status
+
+
+def _outcome_body(outcome):
+    '''
+    (body, status) for one result or the exception raised for that image
+    '''
+    if isinstance(outcome, ImageTooLargeError):
+        return {"error": str(outcome)}, 413
+    if isinstance(outcome, FetchError):
+        return {"error": str(outcome)}, 502
+    if isinstance(outcome, QueueFullError):
+        return {"error": str(outcome)}, 429
+    if isinstance(outcome, (ValueError, TypeError)):
+        return {"error": str(outcome)}, 400
+    if isinstance(outcome, Exception):
+        logger.error("Scoring failed: %s", outcome)
+        return {"error": str(outcome)}, 500
+    if isinstance(outcome, QAResult):
+        return outcome.to_dict(), 200
+    # Cached results are stored as plain JSON types (ResultCache)
+    return outcome, 200
+
+
+def _result_or_error(future: Future, timeout: float):
+    '''
+    (body, status) for one scored image
+    '''
+    try:
+        result = future.result(timeout=timeout)
+    except TimeoutError:
+        return {"error": "Timed out while scoring the image"}, 504
+    return _outcome_body(result)
+
+
+def create_app(pool: ScoringPool, version: int = 1, timeout: float = 30.0,
+               max_batch_size: int = 32, fetcher: BackgroundFetcher = None, profiler: SamplingProfiler = None) -> Flask:
+    '''
+    pool: ScoringPool that runs the checks, /metrics is served when it has a MetricsAggregator
+    version: Default face classificator, a request can override it with a "version" field
+    timeout: Seconds to wait for a result before answering 504
+    max_batch_size: Maximum number of images accepted by /batch
+    fetcher: Downloader used by /url and /batch urls (a BackgroundFetcher with default limits if None)
+    profiler: SamplingProfiler switched on and off by /profile, the route only exists when one is given
+    '''
+    app = Flask(__name__)
+    fetcher = fetcher if fetcher is not None else BackgroundFetcher()
+
+    @app.errorhandler(QueueFullError)
+    def queue_full(e):
+        return _error(str(e), 429)
+
+    @app.errorhandler(ImageTooLargeError)
+    def image_too_large(e):
+        return _error(str(e), 413)
+
+    @app.errorhandler(FetchError)
+    def fetch_failed(e):
+        return _error(str(e), 502)
+
+    @app.errorhandler(ConfigError)
+    def config_error(e):
+        return _error(str(e), 400)
+
+    @app.errorhandler(BadRequest)
+    def bad_request(e):
+        return _error(e.description, 400)
+
+    def submit(images, data):
+        request_version = data.get('version', version)
+        if request_version not in (1, 2):
+            raise BadRequest("'version' must be 1 or 2")
+        return pool.submit_many(images, request_version, data.get('profile'))
+
+    @app.route('/cache', methods=['GET'])
+    def cache_stats():
+        if pool.cache is None:
+            return _error("Result cache is disabled", 404)
+        return jsonify(pool.cache.stats())
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if pool.metrics is None:
+            return _error("Metrics are disabled", 404)
+        gauges = {"face_qa_in_flight": ("Images queued or running", pool.in_flight)}
+        if pool.cache is not None:
+            for name, value in pool.cache.stats().items():
+                gauges[f"face_qa_cache_{name}"] = (f"Result cache {name.replace('_', ' ')}", value)
+        body = pool.metrics.render() + render_gauges(gauges)
+        return Response(body, mimetype="text/plain; version=0.0.4")
+
+    if profiler is not None:
+        @app.route('/profile', methods=['GET', 'POST'])
+        def profile():
+            # POST {"enabled": true, "interval": 0.01} starts sampling, {"enabled": false} stops it,
+            # GET returns the collapsed stacks sampled so far
+            if request.method == 'POST':
+                data = request.get_json(silent=True) or {}
+                interval = data.get('interval')
+                if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0):
+                    raise BadRequest("'interval' must be a positive number of seconds")
+                if data.get('reset'):
+                    profiler.reset()
+                if data.get('enabled'):
+                    profiler.start(interval)
+                elif 'enabled' in data:
+                    profiler.stop()
+                return jsonify({"enabled": profiler.enabled, "interval": profiler.interval, "samples": profiler.samples})
+            return Response(profiler.collapsed(), mimetype="text/plain")
+
+    @app.route('/base64', methods=['POST'])
+    def analyze_base64():
+        data = request.get_json(silent=True)
+        if not data or 'image' not in data:
+            return _error("Missing 'image' field in JSON", 400)
+
+        try:
+            image_data = decode_base64_image(data['image'])
+        except (binascii.Error, ValueError):
+            return _error("Invalid base64 image", 400)
+
+        futures = submit([image_data], data)
+
+        body, status = _result_or_error(futures[0], timeout)
+        return jsonify(body), status
+
+    @app.route('/url', methods=['POST'])
+    def analyze_url():
+        data = request.get_json(silent=True)
+        if not data or 'url' not in data:
+            return _error("Missing 'url' field in JSON", 400)
+
+        url_image = data['url']
+        if not url_image:
+            return _error("Missing 'url' parameter", 400)
+
+        # The download runs on the fetcher event loop, the scoring workers stay free meanwhile
+        image_data = fetcher.fetch(url_image, timeout=timeout)
+
+        futures = submit([image_data], data)
+
+        body, status = _result_or_error(futures[0], timeout)
+        return jsonify(body), status
+
+    @app.route('/batch', methods=['POST'])
+    def analyze_batch():
+        data = request.get_json(silent=True)
+        if data and isinstance(data.get('urls'), list):
+            return analyze_batch_urls(data)
+        if not data or not isinstance(data.get('images'), list):
+            return _error("Missing 'images' or 'urls' list in JSON", 400)
+        if len(data['images']) > max_batch_size:
+            return _error(f"At most {max_batch_size} images per batch", 413)
+
+        try:
+            images = [decode_base64_image(image) for image in data['images']]
+        except (binascii.Error, ValueError):
+            return _error("Invalid base64 image", 400)
+
+        futures = submit(images, data)
+
+        # Images run in parallel on the pool, the timeout covers the whole batch
+        deadline = time.monotonic() + timeout
+        results = []
+        for future in futures:
+            body, status = _result_or_error(future, max(deadline - time.monotonic(), 0))
+            if status != 200:
+                body["status"] = status
+            results.append(body)
+        return jsonify({"results": results})
+
+    def analyze_batch_urls(data):
+        urls = data['urls']
+        if len(urls) > max_batch_size:
+            return _error(f"At most {max_batch_size} images per batch", 413)
+        request_version = data.get('version', version)
+        if request_version not in (1, 2):
+            raise BadRequest("'version' must be 1 or 2")
+        profile = data.get('profile')
+        pool.config_store.get(profile)
+
+        # Downloads overlap with the scoring of the images already fetched
+        submit_url = functools.partial(pool.submit, profile=profile)
+        future = fetcher.submit(score_urls(fetcher.fetcher, urls, submit_url, request_version))
+        try:
+            outcomes = future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            return _error("Timed out while scoring the images", 504)
+
+        results = []
+        for outcome in outcomes:
+            body, status = _outcome_body(outcome)
+            if status != 200:
+                body["status"] = status
+            results.append(body)
+        return jsonify({"results": results})
+
+    return app
+
+
+def serve(host: str = "0.0.0.0", port: int = 5000, workers: int = None, max_queue: int = 64,
+          threads: int = 16, version: int = 1, timeout: float = 30.0, max_batch_size: int = 32,
+          max_download_bytes: int = DEFAULT_MAX_BYTES, cache_size: int = 1024, cache_ttl: float = None,
+          cache_path: str = None, mode: str = "process", shared_memory_slab: int = 0, profiling: bool = False):
+    '''
+    Run the HTTP service with waitress until interrupted
+    profiling: Serve /profile, which anyone reaching the service can switch on, off by default
+    '''
+    from waitress import serve as waitress_serve
+
+    cache = ResultCache(max_entries=cache_size, ttl=cache_ttl, disk_path=cache_path) if cache_size > 0 else None
+    pool = ScoringPool(workers=workers, max_queue=max_queue, mode=mode, cache=cache, metrics=MetricsAggregator(),
+                       shared_memory_slab=shared_memory_slab)
+    fetcher = BackgroundFetcher(max_bytes=max_download_bytes)
+    try:
+        pool.preload()
+        app = create_app(pool, version=version, timeout=timeout, max_batch_size=max_batch_size, fetcher=fetcher,
+                         profiler=SamplingProfiler() if profiling else None)
+        logger.info("Serving on %s:%s", host, port)
+        waitress_serve(app, host=host, port=port, threads=threads)
+    finally:
+        fetcher.close()
+        pool.close()
+        if cache is not None:
+            cache.close()
@@ -0,0 +1,105 @@
+'''
+Shared memory hand-off of images to the worker processes.
+
+Sending an image to a process pool pickles it: a decoded 12MP BGR array is 36MB
+copied through a pipe, and a few MB for an encoded file. SlabPool owns one shared
+memory segment cut into fixed-size slabs. The parent copies each image once into a
+free slab and sends the worker a SharedRef of a few bytes. The worker maps the
+segment once and reads the image through an np.ndarray view, without copying it,
+straight into the decode-once path of FaceQAEngine.check(). The slab is reused as
+soon as the result is back.
+
+Images bigger than a slab, and sources that are not pixels or bytes (paths), are
+sent as before.
+'''
+from multiprocessing import shared_memory
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+import collections
+import threading
+import numpy as np
+
+
+class SharedRef(NamedTuple):
+    '''
+    Location of one image in a SlabPool segment
+    encoded: Encoded file bytes (a 1-D uint8 buffer) rather than decoded pixels
+    '''
+    name: str
+    slab: int
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+    encoded: bool
+
+
+class SlabPool():
+    '''
+    Ring of fixed-size shared memory slabs, reused for every image handed to the workers.
+    slab_bytes: Size of each slab, bigger images are not shared
+    slabs: Number of slabs, put() waits for a free one when all are in use
+    '''
+    def __init__(self, slab_bytes: int, slabs: int):
+        self.slab_bytes = slab_bytes
+        self.slabs = slabs
+        self._memory = shared_memory.SharedMemory(create=True, size=slab_bytes * slabs)
+        self._free = collections.deque(range(slabs))
+        self._available = threading.Condition()
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def put(self, image: Any, timeout: float = None) -> Optional[SharedRef]:
+        '''
+        Copy image (np.ndarray, bytes, bytearray or memoryview) into a free slab.
+        Returns None when image is of another type or too big, it must then be sent as is.
+        '''
+        if isinstance(image, np.ndarray):
+            array, encoded = image, False
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            array, encoded = np.frombuffer(image, np.uint8), True
+        else:
+            return None
+        if array.nbytes > self.slab_bytes or array.dtype.hasobject:
+            return None
+
+        with self._available:
+            if not self._available.wait_for(lambda: self._free, timeout):
+                return None
+            slab = self._free.popleft()
+        offset = slab * self.slab_bytes
+        view = np.ndarray(array.shape, array.dtype, buffer=self._memory.buf, offset=offset)
+        view[...] = array
+        return SharedRef(self._memory.name, slab, offset, array.shape, array.dtype.str, encoded)
+
+    def release(self, ref: SharedRef):
+        with self._available:
+            self._free.append(ref.slab)
+            self._available.notify()
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+
+# Segments mapped by this worker process, by name
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def attach(ref: SharedRef):
+    '''
+    View of the image of ref in the worker process, without copy.
+    Returns an np.ndarray of decoded pixels or a memoryview of the encoded bytes.
+    The view is only valid until the result is returned, the slab is then reused.
+    '''
+    memory = _attached.get(ref.name)
+    if memory is None:
+        memory = _attached[ref.name] = _open(ref.name)
+    array = np.ndarray(ref.shape, np.dtype(ref.dtype), buffer=memory.buf, offset=ref.offset)
+    return memoryview(array) if ref.encoded else array
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    # Workers are spawned by the pool and share the resource tracker of the parent,
+    # which owns the segment and unlinks it in SlabPool.close()
+    return shared_memory.SharedMemory(name)
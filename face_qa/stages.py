@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from typing import Dict, Sequence, Tuple
+import time
+
+# Stages of one check() call, in pipeline order
+STAGES = ("cache", "decode", "dedupe", "detection", "eyes", "smile", "contrast", "brightness", "centering", "annotation")
+
+# Measurement stages of the full report, in the order they run
+FULL_ORDER = ("detection", "eyes", "smile", "contrast", "brightness", "centering")
+
+# Estimated relative cost of each measurement stage, fail-fast mode runs the cheapest first
+STAGE_COST = {
+    "brightness": 1,
+    "contrast": 1,
+    "centering": 1,
+    "eyes": 10,
+    "detection": 20,
+    "smile": 40,
+}
+
+# Stages that work on the detected faces and must run after detection
+FACE_STAGES = ("eyes", "smile", "centering")
+
+
+def stage_order(order: Sequence[str] = None) -> Tuple[str, ...]:
+    '''
+    Fail-fast order of the measurement stages.
+    order: Stages in the wanted order (config["check_order"]), the missing ones follow by cost.
+    Without it the stages are sorted by STAGE_COST, face stages always after detection.
+    '''
+    order = list(order or ())
+    unknown = [stage for stage in order if stage not in STAGE_COST]
+    if unknown:
+        raise ValueError(f"Unknown stages in check_order: {unknown}")
+    repeated = sorted({stage for stage in order if order.count(stage) > 1})
+    if repeated:
+        raise ValueError(f"Repeated stages in check_order: {repeated}")
+    order += sorted((stage for stage in STAGE_COST if stage not in order), key=STAGE_COST.get)
+
+    # Face stages placed before detection are moved right after it, keeping their order
+    detection = order.index("detection")
+    early = [stage for stage in order[:detection] if stage in FACE_STAGES]
+    order = [stage for stage in order if stage not in early]
+    detection = order.index("detection")
+    return tuple(order[:detection + 1] + early + order[detection + 1:])
+
+
+class StageTimer():
+    '''
+    Wall time in seconds of each pipeline stage of one check() call.
+    FaceQAEngine creates one per call through its timer_factory attribute,
+    so a subclass can record more than the time (see face_qa.benchmark).
+    hooks: face_qa.monitoring.StageHook called around each stage
+    '''
+    def __init__(self, hooks: Sequence = ()):
+        self.timings: Dict[str, float] = {}
+        self.hooks = hooks
+
+    @contextmanager
+    def stage(self, name: str):
+        for hook in self.hooks:
+            hook.stage_started(name)
+        error = None
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            for hook in self.hooks:
+                hook.stage_finished(name, seconds, error)
@@ -0,0 +1,227 @@
+'''
+Live scoring of a camera or a video file.
+
+StreamQA reads frames on a background thread and scores the newest one with a
+StreamEngine, whose models run in video mode: BlazeFace uses the VIDEO running
+mode and FaceMesh tracks the landmarks from frame to frame instead of detecting
+the face again. When scoring is slower than the camera the older frames are
+dropped, so the feedback always refers to what is in front of the camera.
+
+Each frame gets its raw result and a smoothed verdict (majority of the last
+window frames for each check), and the best frame seen so far is kept.
+'''
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, Tuple, Union
+import collections
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from face_qa.context import FaceContext
+from face_qa.engine import MODELS_DIR, FaceQAEngine, load_mediapipe
+from face_qa.image_loader import LoadedImage
+from face_qa.metrics import PASSING
+
+if TYPE_CHECKING:
+    import mediapipe as mp
+
+VideoSource = Union[int, str]
+
+
+class StreamEngine(FaceQAEngine):
+    '''
+    FaceQAEngine for consecutive frames of one video.
+    Frames must be scored in order with increasing timestamps (see score()).
+    '''
+    # Eyes are wider than 15% of the face, skipping the smaller scales keeps up with the frame rate
+    eye_min_size = 0.15
+
+    def __init__(self, config_path: str = '/config.json'):
+        self.timestamp_ms = 0
+        super().__init__(config_path)
+
+    def _create_face_detector(self):
+        mp = load_mediapipe()
+        BaseOptions = mp.tasks.BaseOptions
+        FaceDetector = mp.tasks.vision.FaceDetector
+        FaceDetectorOptions = mp.tasks.vision.FaceDetectorOptions
+        VisionRunningMode = mp.tasks.vision.RunningMode
+
+        options = FaceDetectorOptions(
+            base_options=BaseOptions(model_asset_path=MODELS_DIR + '/blaze_face_short_range.tflite'),
+            running_mode=VisionRunningMode.VIDEO)
+        return FaceDetector.create_from_options(options)
+
+    def _create_face_mesh(self):
+        # Landmarks are tracked between frames, the face is only detected again when tracking is lost
+        mp = load_mediapipe()
+        return mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=True)
+
+    def _detect(self, mp_image: 'mp.Image'):
+        return self.face_detector.detect_for_video(mp_image, self.timestamp_ms)
+
+    def _face_mesh_input(self, working: LoadedImage, faces: FaceContext, index: int = 0) -> Tuple[np.ndarray, Tuple[int, int]]:
+        # Tracking needs the same field of view on every frame, so FaceMesh gets the whole frame
+        return working.rgb, (0, 0)
+
+    def score(self, frame: np.ndarray, timestamp_ms: int, version: int = 2, config: dict = None) -> dict:
+        '''
+        frame: BGR frame
+        timestamp_ms: Frame time, must increase from one call to the next
+        '''
+        self.timestamp_ms = timestamp_ms
+        return self.check(frame, version, config)
+
+
+class FrameReader():
+    '''
+    Reads the frames of a cv2.VideoCapture on its own thread.
+
+    drop: Keep only the newest frame, the older ones are dropped when the consumer is slower
+    Iterating gives (index, timestamp_ms, frame) until the source ends or close() is called.
+    '''
+    def __init__(self, capture: cv2.VideoCapture, drop: bool = True, buffer: int = 8):
+        self.capture = capture
+        self.drop = drop
+        self.dropped = 0
+        self._frames = queue.Queue(maxsize=1 if drop else buffer)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._read, name="face-qa-frames", daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        index = 0
+        start = time.monotonic()
+        while not self._closed.is_set():
+            ok, frame = self.capture.read()
+            if not ok:
+                break
+            if self.drop:
+                timestamp_ms = int((time.monotonic() - start) * 1000)
+            else:
+                timestamp_ms = int(self.capture.get(cv2.CAP_PROP_POS_MSEC))
+            self._put((index, timestamp_ms, frame))
+            index += 1
+        self._put(None)
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.drop and item is not None:
+                    try:
+                        self._frames.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def __iter__(self) -> Iterator[Tuple[int, int, np.ndarray]]:
+        while True:
+            item = self._frames.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+
+def smooth(history) -> dict:
+    '''
+    Majority value of each check over the results in history, None when no frame has a value
+    '''
+    smoothed = {}
+    for name in PASSING:
+        values = [result[name] for result in history if result[name] is not None]
+        smoothed[name] = sum(values) * 2 > len(values) if values else None
+    return smoothed
+
+
+def frame_quality(result: dict) -> int:
+    '''
+    Number of checks at their passing value
+    '''
+    return sum(result[name] == value for name, value in PASSING.items())
+
+
+class StreamQA():
+    '''
+    source: Camera index or video file path/URL
+    version: Face Classificator 1: haarcascade 2: mediapipe BlazeFace
+    window: Number of frames the verdicts are smoothed over
+    drop_frames: Skip frames when scoring falls behind, by default only for cameras
+    '''
+    def __init__(self, source: VideoSource, version: int = 2, config_path: str = '/config.json', window: int = 15,
+                 drop_frames: bool = None):
+        self.source = source
+        self.version = version
+        self.window = window
+        self.drop_frames = isinstance(source, int) if drop_frames is None else drop_frames
+        self.engine = StreamEngine(config_path)
+        # Best frame so far: index, timestamp_ms, frame, result and quality
+        self.best = None
+
+    def frames(self, max_frames: int = None) -> Iterator[dict]:
+        '''
+        Score the frames of the source, yields one dict per scored frame with its
+        index, timestamp_ms, result, smoothed verdict and the number of dropped frames
+        '''
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video source: {self.source}")
+        reader = FrameReader(capture, drop=self.drop_frames)
+        history = collections.deque(maxlen=self.window)
+        last_timestamp = -1
+        try:
+            for count, (index, timestamp_ms, frame) in enumerate(reader):
+                if max_frames is not None and count >= max_frames:
+                    break
+                # MediaPipe needs strictly increasing timestamps
+                timestamp_ms = max(timestamp_ms, last_timestamp + 1)
+                last_timestamp = timestamp_ms
+
+                result = self.engine.score(frame, timestamp_ms, self.version)
+                history.append(result)
+                self._keep_best(index, timestamp_ms, frame, result)
+                yield {
+                    "index": index,
+                    "timestamp_ms": timestamp_ms,
+                    "dropped": reader.dropped,
+                    "result": result,
+                    "smoothed": smooth(history),
+                }
+        finally:
+            reader.close()
+            capture.release()
+
+    def _keep_best(self, index: int, timestamp_ms: int, frame: np.ndarray, result: dict):
+        quality = frame_quality(result)
+        if self.best is not None and quality < self.best["quality"]:
+            return
+        # Ties go to the sharpest frame
+        sharpness = cv2.Laplacian(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var()
+        if self.best is None or (quality, sharpness) > (self.best["quality"], self.best["sharpness"]):
+            self.best = {"index": index, "timestamp_ms": timestamp_ms, "frame": frame,
+                         "result": result, "quality": quality, "sharpness": sharpness}
+
+    def run(self, max_frames: int = None, callback: Callable[[dict], Optional[bool]] = None) -> Optional[dict]:
+        '''
+        Score the source until it ends, max_frames are scored or callback returns True.
+        Returns the best frame
+        '''
+        for update in self.frames(max_frames):
+            if callback is not None and callback(update):
+                break
+        return self.best
+
+    def close(self):
+        self.engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
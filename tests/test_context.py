@@ -0,0 +1,13 @@
+from face_qa.context import FaceContext
+
+
+def test_scaled_keeps_the_order_of_near_equal_faces():
+    # 100 > 99 pixels, but 4 < 6 once reduced to a quarter and rounded
+    faces = FaceContext([(40, 0, 11, 9), (0, 0, 10, 10)], [0.2, 0.9], [[(45.0, 4.0)], [(5.0, 5.0)]])
+    assert faces.boxes == [(0, 0, 10, 10), (40, 0, 11, 9)]
+
+    reduced = faces.scaled(0.25)
+    assert reduced.boxes == [(0, 0, 2, 2), (10, 0, 3, 2)]
+    assert reduced.scores == [0.9, 0.2]
+    assert reduced.keypoints == [[(1.25, 1.25)], [(11.25, 1.0)]]
+    assert reduced.scaled(4).scores == faces.scores
@@ -0,0 +1,33 @@
+import os
+from face_qa.engine import FaceQAEngine
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'images', 'image_2.jpg')
+
+
+def _faces(engine):
+    return [(face.box, face.metrics) for face in engine.check_faces(EXAMPLE, 1)]
+
+
+def test_check_faces_in_parallel_matches_sequential():
+    sequential = FaceQAEngine()
+    sequential.face_workers = 1
+    parallel = FaceQAEngine()
+    parallel.face_workers = 4
+    try:
+        expected = _faces(sequential)
+        assert len(expected) > 1
+        for _ in range(20):
+            assert _faces(parallel) == expected
+    finally:
+        sequential.close()
+        parallel.close()
+
+
+def test_check_faces_after_close():
+    engine = FaceQAEngine()
+    try:
+        expected = _faces(engine)
+        engine.close()
+        assert _faces(engine) == expected
+    finally:
+        engine.close()
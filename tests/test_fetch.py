@@ -0,0 +1,117 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import pytest
+from face_qa.fetch import BackgroundFetcher, FetchError, ImageTooLargeError
+from face_qa.server import ScoringPool, create_app
+
+MAX_BYTES = 1024
+IMAGE = b"\xff\xd8" + b"\0" * 500
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.clients.append(self.client_address)
+        if self.path == "/image":
+            self._send(200, IMAGE)
+        elif self.path == "/big":
+            self._send(200, b"\0" * (MAX_BYTES + 1))
+        elif self.path == "/stream":
+            # Chunked body without a Content-Length, only the read size shows it is too big
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(4):
+                chunk = b"\0" * (MAX_BYTES // 2)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path == "/slow":
+            time.sleep(1.0)
+            self._send(200, IMAGE)
+        else:
+            self._send(404, b"not found")
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.block_on_close = False
+    httpd.clients = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = BackgroundFetcher(max_bytes=MAX_BYTES, read_timeout=0.2)
+    try:
+        yield fetcher
+    finally:
+        fetcher.close()
+
+
+def test_connection_is_reused(server, fetcher):
+    httpd, url = server
+    for _ in range(3):
+        assert fetcher.fetch(url + "/image") == IMAGE
+    assert len(httpd.clients) == 3
+    assert len(set(httpd.clients)) == 1
+
+
+@pytest.mark.parametrize("path", ["/big", "/stream"])
+def test_too_large(server, fetcher, path):
+    _, url = server
+    with pytest.raises(ImageTooLargeError):
+        fetcher.fetch(url + path)
+
+
+@pytest.mark.parametrize("path", ["/big", "/stream"])
+def test_too_large_answers_413(server, fetcher, path):
+    _, url = server
+    pool = ScoringPool(workers=1, mode="thread")
+    try:
+        client = create_app(pool, fetcher=fetcher).test_client()
+        assert client.post('/url', json={"url": url + path}).status_code == 413
+    finally:
+        pool.close()
+
+
+def test_http_error_status(server, fetcher):
+    _, url = server
+    with pytest.raises(FetchError, match="HTTP 404") as error:
+        fetcher.fetch(url + "/missing")
+    assert not isinstance(error.value, ImageTooLargeError)
+
+
+def test_read_timeout(server, fetcher):
+    _, url = server
+    with pytest.raises(FetchError):
+        fetcher.fetch(url + "/slow")
+
+
+def test_overall_timeout(server):
+    _, url = server
+    fetcher = BackgroundFetcher(max_bytes=MAX_BYTES, read_timeout=10.0)
+    try:
+        with pytest.raises(FetchError, match="Timed out"):
+            fetcher.fetch(url + "/slow", timeout=0.2)
+    finally:
+        fetcher.close()
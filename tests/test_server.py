@@ -0,0 +1,58 @@
+import base64
+import os
+import pytest
+from face_qa.cache import ResultCache
+from face_qa.monitoring import SamplingProfiler
+from face_qa.server import ScoringPool, create_app
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'images', 'image_4.jpeg')
+
+
+@pytest.fixture
+def client():
+    pool = ScoringPool(workers=1, mode="thread")
+    try:
+        yield create_app(pool).test_client()
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize("image", [123, None, ["a"], "not base64!"])
+def test_base64_rejects_invalid_images(client, image):
+    response = client.post('/base64', json={"image": image})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid base64 image"}
+
+
+def test_profile_is_off_by_default(client):
+    assert client.get('/profile').status_code == 404
+    assert client.post('/profile', json={"enabled": True}).status_code == 404
+
+
+def test_profile_with_a_profiler():
+    pool = ScoringPool(workers=1, mode="thread")
+    profiler = SamplingProfiler()
+    try:
+        client = create_app(pool, profiler=profiler).test_client()
+        assert client.post('/profile', json={"enabled": True}).get_json()["enabled"] is True
+        assert client.post('/profile', json={"enabled": False}).get_json()["enabled"] is False
+    finally:
+        profiler.stop()
+        pool.close()
+
+
+def test_cache_hit_returns_the_same_result():
+    pool = ScoringPool(workers=1, mode="thread", cache=ResultCache())
+    try:
+        client = create_app(pool).test_client()
+        with open(EXAMPLE, 'rb') as image_file:
+            body = {"image": base64.b64encode(image_file.read()).decode()}
+        first = client.post('/base64', json=body).get_json()
+        pool.executor.shutdown(wait=True)
+        second = client.post('/base64', json=body).get_json()
+        assert pool.cache.stats()["hits"] == 1
+        assert list(second["timings"]) == ["cache"]
+        del first["timings"], second["timings"]
+        assert second == first
+    finally:
+        pool.close()
@@ -0,0 +1,7 @@
+import pytest
+from face_qa.config import ConfigError, load_config
+
+
+def test_check_order_rejects_repeated_stages():
+    with pytest.raises(ConfigError, match="Repeated stages"):
+        load_config().replace(check_order=["brightness", "detection", "brightness"])